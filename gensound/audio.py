@@ -7,9 +7,11 @@ some may be instance functions, some may belong in utils.
 
 import warnings
 import copy
+import tempfile
 
 import numpy as np
 
+from gensound import settings
 from gensound.settings import _supported
 from gensound.utils import sec, sample_rates
 
@@ -19,6 +21,19 @@ def warning_msg(message, category, filename, lineno, file=None, line=None):
 
 warnings.formatwarning = warning_msg
 
+def _zeros(shape):
+    """ np.zeros for audio, which is memory-mapped to a temporary file
+    if it is at least settings.memmap_threshold bytes.
+    """
+    size = int(np.prod(shape))*np.dtype(np.float64).itemsize
+    
+    if settings.memmap_threshold is None or size == 0 or size < settings.memmap_threshold:
+        return np.zeros(shape, dtype=np.float64)
+    
+    # the file is deleted once the mapping is closed
+    with tempfile.TemporaryFile(dir=settings.memmap_dir) as file:
+        return np.memmap(file, dtype=np.float64, mode="w+", shape=shape)
+
 
 
 class Audio:
@@ -36,6 +51,35 @@ class Audio:
         # TODO get rid of sample_rate argument and have optional audio argument
         # that can be np.ndarray or other array or something
         self.audio = np.zeros((1, 0), dtype=np.float64)
+        self._buffer = None # see Audio._grow
+        self._view = None
+    
+    shared = False
+    """ Whether self.audio may be referenced elsewhere (e.g. it is cached),
+    in which case it is copied once it is about to be modified in place (see Audio.own),
+    so readers never pay for a copy. Audio returned by Signal.realise() is never shared.
+    """
+    
+    headroom = 0.5
+    """ When the audio grows beyond its backing buffer (see Audio.extend, Audio.push_forward),
+    the buffer is reallocated with this fraction of the new length as spare capacity
+    in the direction of growth, so that growing repeatedly costs amortised O(1) per sample,
+    rather than copying all the audio so far each time.
+    """
+    
+    def __getstate__(self):
+        # the spare capacity is not worth copying or pickling
+        state = self.__dict__.copy()
+        state.update(_buffer=None, _view=None)
+        return state
+    
+    def allocate(self, start, end, num_channels=1):
+        """ Replaces the audio with silence spanning the sample positions [start, end),
+        so that audio within this range may later be mixed into it without reallocation.
+        """
+        self.audio = _zeros((num_channels, end - start))
+        self.shift = start
+        return self
     
     def ensure_2d(self): # TODO should move to utils
         """ makes sure self.audio is 2-dimensional,
@@ -48,11 +92,15 @@ class Audio:
         return True # the shape was fine all along
         
     
-    def from_array(self, array):
+    def from_array(self, array, copy=True):
         """
         converts np.ndarray to Audio.
         if array is not of type np.float64, converts it implicitly!
         note that this normalizes the values to be within [-1,1]
+        
+        the array is copied, so that the Audio owns its buffer and may modify it in place,
+        unless copy=False, which is only meant for arrays which nothing else refers to
+        (such as freshly generated ones); the Audio then takes over the array itself.
         """
         if not isinstance(array, np.ndarray):
             array = np.asarray(array, dtype=np.float64)
@@ -60,9 +108,11 @@ class Audio:
         self.audio = array
         self.ensure_2d()
         
-        # TODO should we copy?
         # note that this is called practically everytime we generate() a signal!!!
-        self.audio = self.audio.copy(order="C")
+        if copy:
+            self.audio = self.audio.copy(order="C")
+        else:
+            self.audio = np.ascontiguousarray(self.audio)
         
         return self
     
@@ -70,7 +120,28 @@ class Audio:
         """
         creates an identical Audio object.
         """
-        return copy.deepcopy(self)
+        audio = copy.deepcopy(self) # without the spare capacity (see __getstate__)
+        audio.shared = False
+        return audio
+    
+    def _share(self):
+        """ as copy(), except that the audio itself is shared by both (see Audio.shared),
+        until either of them is modified in place through Audio.own().
+        """
+        audio = copy.copy(self)
+        self.shared = audio.shared = True
+        return audio
+    
+    def own(self):
+        """ Copies the audio if it is shared (see Audio.shared),
+        so that it may be modified in place.
+        """
+        if not self.shared:
+            return
+        audio = _zeros(self.audio.shape)
+        audio[...] = self.audio
+        self.audio = audio
+        self.shared = False
     
     ####### getters #######
     
@@ -124,23 +195,18 @@ class Audio:
         """
         reshapes self.audio so other.audio may be mixed into it.
         
-        ensures other is a 2-d ndarray of similar 1st shape,
-        and that self.length >= other.length
-        and that self has enough channels
+        ensures that self covers the samples of other,
+        and that self has enough channels.
+        if other is mono, it is not expanded; rather it is broadcast
+        into all the channels of self when mixed, saving the copies.
         note that this function has side effects for self.audio!
-        
-        and unfortunately also for other.
         """
         
         assert isinstance(other, Audio), "Audio.conform can only be used between Audios"
         assert other.is_mono or self.is_mono or other.num_channels == self.num_channels
         
         # conforming channels
-        if other.is_mono:
-            other.from_mono(self.num_channels)
-            # TODO warning: this affects other.
-        
-        if self.is_mono:
+        if self.is_mono and not other.is_mono:
             self.from_mono(other.num_channels)
         
         # conforming lengths TODO better way?
@@ -164,18 +230,58 @@ class Audio:
     
     def extend(self, how_much):
         """ extends all available channels with zeros """
-        self.audio = np.pad(self.audio, ((0,0),(0,how_much)), mode="constant", constant_values=0.0)
+        if how_much == 0:
+            return
+        self._grow(0, how_much)
     
     def push_forward(self, how_much):
         """ pads the beginning with zeros """
          # TODO sister function which truncates beginning when shift < 0? for use in Combine
-        if how_much < 0:
+        if how_much <= 0:
             return
-        # pad with nothing before and after the channel dimension
-        # pad with how_much before the time dimension, 0 after
-        self.audio = np.pad(self.audio, ((0,0),(how_much,0)), mode="constant", constant_values=0.0)
+        self._grow(how_much, 0)
         self.shift -= how_much
     
+    def _grow(self, before, after, num_channels=1):
+        """ Pads self.audio with zeros: before and after it in time, and below it
+        up to num_channels. self.audio is a view onto a larger backing buffer, so this
+        is done in place when the buffer has room, and otherwise reallocates it with headroom.
+        """
+        num_channels = max(num_channels, self.num_channels)
+        
+        if self.audio is not self._view or self.shared: # so the buffer may only be reallocated
+            self._buffer, self._start = self.audio, 0
+        
+        start, end = self._start - before, self._start + self.length + after
+        
+        if start < 0 or end > self._buffer.shape[1] or num_channels > self._buffer.shape[0]:
+            spare = int(self.headroom*(end - start))
+            offset = (spare if before else 0) - start
+            buffer = _zeros((num_channels, offset + end + (spare if after else 0)))
+            buffer[:self.num_channels, offset+self._start:offset+self._start+self.length] = self.audio
+            self._buffer, start, end = buffer, start + offset, end + offset
+            self.shared = False
+        else: # the spare capacity may hold cropped audio
+            self._buffer[:num_channels, start:self._start] = 0
+            self._buffer[:num_channels, self._start+self.length:end] = 0
+            self._buffer[self.num_channels:num_channels, start:end] = 0
+        
+        self._start = start
+        self.audio = self._view = self._buffer[:num_channels, start:end]
+    
+    def crop(self, start, end):
+        """ Keeps only the sample positions [start, end), which should lie within the audio.
+        """
+        if (start, end) == (self.abs_start(), self.abs_end()):
+            return
+        if self.audio is self._view: # the rest of the buffer becomes spare capacity
+            self._start += start - self.shift
+            self._view = self._view[:,start-self.shift:end-self.shift]
+            self.audio = self._view
+        else:
+            self.audio = self.audio[:,start-self.shift:end-self.shift]
+        self.shift = start
+    
     def _resample(self, sample_rate, method):
         """ Uses interpolation to change the sample rate of the audio
         while retaining spectral content.
@@ -207,16 +313,17 @@ class Audio:
         assert self.is_mono, "Can't call Audio.from_mono() for non-mono Audio."
         if num_channels == 1:
             return
-        self.audio = self.audio.copy() # TODO is this wasteful?
-        self.audio.resize((num_channels, self.length), refcheck=False)
-        self.audio[:,:] = self.audio[0,:]
-        assert self.ensure_2d()
+        # only done where the channels are about to be written separately;
+        # when mixing, mono audio is broadcast instead (see Audio.conform)
+        audio = _zeros((num_channels, self.length))
+        audio[:,:] = self.audio
+        self.audio = audio
+        self.shared = False
     
     def to_channels(self, num_channels):
         """ ensures there are at least num_channels
         """
-        shape = (num_channels-self.num_channels, self.length)
-        self.audio = np.vstack((self.audio, np.zeros(shape, dtype=np.float64)))
+        self._grow(0, 0, num_channels)
     
     ######## binary operations ###########
     
@@ -224,6 +331,7 @@ class Audio:
         assert isinstance(other, Audio)
         
         self.conform(other)
+        self.own()
         self.audio[:,other.abs_start()-self.abs_start():other.abs_start()-self.abs_start()+other.length] += other.audio
         return self
     
@@ -259,6 +367,7 @@ class Audio:
             assert len(other.shape) == 1, "can multiply Audio by np.ndarray only for one-dimensional arrays"
             if other.shape[0] > self.length:
                 other = other[0:self.length]
+            self.own()
             self.audio[:,0:other.shape[0]] *= other
             return
             
@@ -266,6 +375,7 @@ class Audio:
         # for multiplying by a float, we multiply the signal instead
         # TODO also does not support with Audios with differing params
         self.conform(other)
+        self.own()
         self.audio[:,other.abs_start()-self.abs_start():other.abs_start()-self.abs_start()+other.length] *= other[:,:]
         return self
     
@@ -299,6 +409,7 @@ class Audio:
         return self.audio.__getitem__(key)
     
     def __setitem__(self, key, value):
+        self.own()
         return self.audio.__setitem__(key, value)
     
     
@@ -343,7 +454,9 @@ class Audio:
         if max_amplitude is not None and max_amplitude > 1:
             warnings.warn("Supplying a value greater than 1 for max_amplitude will likely lead to distorted audio and clipping.")
         
-        max_amp = np.max(np.abs(self.audio))
+        # a block at a time, sparing a copy of all the (possibly memory-mapped) audio
+        max_amp = max([np.max(np.abs(self.audio[:,i:i+Audio.block_size]))
+                       for i in range(0, self.length, Audio.block_size)])
         
         if max_amplitude is None and max_amp <= 1:
             # fits within default range
@@ -357,14 +470,24 @@ class Audio:
                           "or to any positive number, which will stretch/shrink it to match the given peak amplitude.")
             max_amplitude = 1
         
-        self.audio = self.audio * (max_amplitude / max_amp)
+        if isinstance(self.audio, np.memmap):
+            self.own()
+            self.audio *= max_amplitude / max_amp
+        else:
+            self.audio = self.audio * (max_amplitude / max_amp)
         
     
     ####### post-mixdown ########
     
-    def _prepare_buffer(self, byte_width, max_amplitude):
+    block_size = 2**16
+    """ Number of samples processed at a time when preparing audio for output,
+    so that long (e.g. memory-mapped) audio isn't copied as a whole.
+    """
+    
+    def _prepare_buffer(self, byte_width, max_amplitude, lazy=False):
         """ Attaches byte width to Audio object, and converts audio information
         to bytes object. This is only done in preparation for output (file or playback).
+        If lazy, the conversion is left to _buffer_blocks() instead.
         """
         from gensound.utils import audio_to_bytes
         
@@ -372,8 +495,23 @@ class Audio:
         self.fit(max_amplitude)
         
         self.byte_width = byte_width
-        self.buffer = audio_to_bytes(self.audio, ["uint8","int16","int24","int32"][byte_width-1])
+        self.buffer = None if lazy else audio_to_bytes(self.audio, Audio._codings[byte_width-1])
+    
+    _codings = ["uint8","int16","int24","int32"] # by byte width
+    
+    def _buffer_blocks(self):
+        """ Yields the bytes of the prepared buffer one block at a time,
+        converting the audio block by block if _prepare_buffer() was lazy,
+        so memory-mapped audio can be written directly to a file.
+        """
+        if self.buffer is not None:
+            yield self.buffer
+            return
+        
+        from gensound.utils import audio_to_bytes
         
+        for i in range(0, self.length, Audio.block_size):
+            yield audio_to_bytes(self.audio[:,i:i+Audio.block_size], Audio._codings[self.byte_width-1])
         
     def play(self, byte_width=2, max_amplitude=None, **kwargs):
         from gensound.io import IO
@@ -407,7 +545,8 @@ class Audio:
         filename = os.fspath(filename)
         ext = file_format or filename.split(".")[-1].lower()
         
-        self._prepare_buffer(byte_width, max_amplitude)
+        # WAV export writes the file a block at a time (see IO.export_WAV)
+        self._prepare_buffer(byte_width, max_amplitude, lazy=ext in ("wav", "wave"))
         
         # TODO disentangle export_WAV arguments so that they will be given
         # seperately (or in a config dict) rather than in an Audio object,
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Caching of computations by the structure of the objects that produced them,
+rather than by their identity, so that equal sub-trees share the same entries.
+
+To reuse realisations of identical signals (e.g. the same drum hit or chord
+appearing many times), set:
+    Signal.realisation_cache = LRUCache(max_bytes=2**30)
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from gensound.utils import isnumber
+
+
+class _Uncacheable(Exception):
+    pass
+
+class _Identity:
+    """ Wraps unhashable objects which can only be compared by identity (i.e. arrays).
+    Holding the object keeps it alive, so its id can't be reused while the key exists.
+    """
+    def __init__(self, obj):
+        self.obj = obj
+    
+    def __hash__(self):
+        return id(self.obj)
+    
+    def __eq__(self, other):
+        return isinstance(other, _Identity) and self.obj is other.obj
+
+def structural_key(obj):
+    """ Describes obj by value, as a hashable nested tuple to be used as a cache key.
+    Objects are described by their class and attributes, recursively;
+    those exposing _cache_params() are described by its return value instead,
+    which may be None if their output is not reproducible.
+    Functions and arrays are described by their identity.
+    
+    Returns None if obj or any of its parts is not reproducible.
+    """
+    try:
+        return _structural_key(obj)
+    except _Uncacheable:
+        return None
+
+def _structural_key(obj):
+    if obj is None or isinstance(obj, (str, bytes)) or isnumber(obj):
+        return (type(obj), obj) # type is needed since ints and floats differ in meaning
+    
+    if isinstance(obj, (list, tuple)):
+        return (type(obj), tuple([_structural_key(item) for item in obj]))
+    
+    if isinstance(obj, dict):
+        return (dict, tuple(sorted([(key, _structural_key(value)) for (key, value) in obj.items()])))
+    
+    if isinstance(obj, slice):
+        return (slice, _structural_key((obj.start, obj.stop, obj.step)))
+    
+    if isinstance(obj, np.ndarray):
+        return (np.ndarray, _Identity(obj))
+    
+    if hasattr(obj, "_cache_params"):
+        params = obj._cache_params()
+        if params is None:
+            raise _Uncacheable
+        return (type(obj), _structural_key(params))
+    
+    if hasattr(obj, "__dict__") and not callable(obj):
+        return (type(obj), _structural_key(vars(obj)))
+    
+    try: # functions, classes etc.
+        hash(obj)
+    except TypeError:
+        return (type(obj), _Identity(obj))
+    return (type(obj), obj)
+
+
+
+class LRUCache:
+    """ Maps keys to values, discarding the least recently used entries
+    once the total size of the values exceeds max_bytes.
+    Keeps count of hits, misses and evictions, see stats().
+    Safe to use from multiple threads.
+    """
+    def __init__(self, max_bytes=2**28):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict() # key -> (value, size)
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+    
+    def put(self, key, value, size):
+        """ stores value under key, size being the number of bytes it occupies.
+        values larger than max_bytes are not stored.
+        """
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+    
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self._entries), "nbytes": self.nbytes, "max_bytes": self.max_bytes}
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, key):
+        return key in self._entries
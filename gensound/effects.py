@@ -3,7 +3,7 @@
 import numpy as np
 
 from gensound.utils import isnumber
-from gensound.curve import Curve
+from gensound.curve import Curve, control_indices, interpolate
 from gensound.transforms import Transform, Convolution
 
 class OneImpulseReverb(Convolution):
@@ -31,18 +31,24 @@ class Vibrato(Transform):
         self.width = width
     
     def realise(self, audio):
+        # at control rate (see Curve.control_step), the offsets are computed at the control points only
         if not isinstance(self.frequency, Curve):
             width_samples = (2**(self.width/12) - 1)/(2*np.pi*self.frequency)*audio.sample_rate
             
             indices = np.arange(0, audio.length, 1, dtype=np.float64)
-            indices += width_samples*np.sin(2*np.pi/audio.sample_rate*self.frequency * indices)
+            points = control_indices(audio.length)
+            times = indices if points is None else points
+            indices += interpolate(width_samples*np.sin(2*np.pi/audio.sample_rate*self.frequency * times), points)
             indices[indices > audio.length-1] = audio.length - 1
             audio.audio[:,:] = audio[:, indices[:]]
         else: # suppose width constant
-            width_samples = (2**(self.width/12) - 1)/(2*np.pi*self.frequency.flatten(audio.sample_rate))*audio.sample_rate
+            points, frequencies = self.frequency.control_values(audio.sample_rate)
+            width_samples = (2**(self.width/12) - 1)/(2*np.pi*frequencies)*audio.sample_rate
+            phases = self.frequency.integral(audio.sample_rate)[:-1]
+            phases = phases if points is None else phases[points]
             
             indices = np.arange(0, audio.length, 1, dtype=np.float64)
-            indices += width_samples * np.sin(2*np.pi * self.frequency.integral(audio.sample_rate)[:-1])
+            indices += interpolate(width_samples * np.sin(2*np.pi * phases), points)
             indices[indices > audio.length-1] = audio.length - 1
             audio.audio[:,:] = audio[:, indices[:]]
             
@@ -54,6 +60,8 @@ class Stretch(Transform):
     """ Stretches audio by a certain factor, or to a desired duration,
     using interpolation.
     """
+    in_place = False
+    
     # TODO parametric stretch!
     def __init__(self, rate=None, duration=None, method="quadratic"):
         """ exactly one of factor, duration should be defined.
@@ -86,6 +94,9 @@ class Stretch(Transform):
             audio.audio = interpolate(audio.audio, indices)
         else:
             raise Exception("Invalid arguments for Stretch.")
+    
+    def extent(self, extent, sample_rate):
+        return None # the length depends on the interpolation indices
         
         
 
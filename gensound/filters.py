@@ -5,6 +5,7 @@ import numpy as np
 from gensound.settings import _supported
 from gensound.curve import Curve, Line, Logistic, Constant
 from gensound.transforms import Transform
+from gensound import parallel
 from gensound.utils import lambda_to_range, DB_to_Linear, \
                   isnumber, iscallable, \
                   num_samples, samples_slice
@@ -101,7 +102,11 @@ class IIR(Transform, Filter):
         assert len(b) == len(a), "Please supply to IIR same number of feedforward and feedback coefficients"
         
         from scipy.signal import lfilter
-        audio.audio[:,:] = lfilter(b, a, audio.audio)
+        
+        def filter_channel(i):
+            audio.audio[i,:] = lfilter(b, a, audio.audio[i,:])
+        
+        parallel.map_channels(filter_channel, audio.num_channels)
     
     def _realise_native(self, audio):
         b, a = self.coefficients(audio.sample_rate)
@@ -85,8 +85,9 @@ class _IO_wave:
         file.setsampwidth(audio.byte_width)
         file.setframerate(audio.sample_rate)
         file.setnframes(audio.length)
-    
-        file.writeframes(audio.buffer)
+        
+        for block in audio._buffer_blocks():
+            file.writeframes(block)
     
     @staticmethod
     def WAV_to_Audio(filename): # filename can also be file-like object (used in _IO_ffmpeg)
@@ -104,7 +105,7 @@ class _IO_wave:
             
             from gensound.audio import Audio
             audio = Audio(file.getframerate())
-            audio.from_array(buffer)
+            audio.from_array(buffer, copy=False)
         
         return audio
 
@@ -141,7 +142,7 @@ class _IO_aifc:
             
             from gensound.audio import Audio
             audio = Audio(file.getframerate())
-            audio.from_array(buffer)
+            audio.from_array(buffer, copy=False)
             
         return audio
     
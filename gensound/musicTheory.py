@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+from functools import lru_cache
+
 import numpy as np
 
 from gensound.utils import isnumber
@@ -115,11 +117,16 @@ def is_upwards_motion(step1, step2):
 
 
 def parse_melody_to_signal(melody_str):
-    # TODO clean this up and generalise
     """
     Returns list of frequency/beats pairs
-    later beats will be multiplied by the given base duration
+    later beats will be multiplied by the given base duration.
+    Parsed melodies are cached, so repeating the same melody string is cheap.
     """
+    return [dict(note) for note in _parse_melody(melody_str)] # the caller may modify them
+
+@lru_cache(maxsize=2**10)
+def _parse_melody(melody_str):
+    # TODO clean this up and generalise
     # sigCls should be of type Oscillator
     beats = 1
     octave = 4
@@ -226,7 +233,7 @@ def parse_melody_to_signal(melody_str):
         sigs.append({"frequency": previous_frequency if not mute else "r", "beats":cur_beat})
         
         
-    return sigs
+    return tuple(sigs)
 
 
 
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Realising independent branches of a signal tree in parallel,
+i.e. the signals of a Mix. See Signal.realise(sample_rate, workers=N, scheduler=...).
+
+The "process" scheduler realises them in worker processes. Audio is passed back
+to the parent process through shared memory, and mixed there in the original order,
+so the result is identical to a serial realise().
+Note that workers only see class-level settings (such as Pan.panLaw) as they were
+when the pool was started, and only if processes are forked (the default on Linux).
+
+The "thread" scheduler uses a pool of threads instead, which is much lighter,
+and works well since most of the time is spent in NumPy/SciPy code that releases the GIL.
+Transforms may also use it to process channels in parallel (see map_channels).
+Work is only distributed from the calling thread; the pool threads realise serially.
+"""
+
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import get_start_method, resource_tracker, shared_memory
+
+import numpy as np
+
+from gensound.audio import Audio
+
+
+_executor = None # the pool used while a parallel realise is in progress
+_threads = False # whether it is a thread pool
+_local = threading.local() # marks the pool threads
+
+@contextmanager
+def pool(workers, scheduler="process"):
+    """ Within this context, Mix realises its signals using a pool of workers,
+    either processes or threads according to scheduler.
+    Does nothing if a pool is already in use (i.e. by an enclosing realise).
+    """
+    global _executor, _threads
+    assert scheduler in ("process", "thread"), "scheduler should be either 'process' or 'thread'"
+    
+    if _executor is not None or workers < 2:
+        yield
+        return
+    
+    if scheduler == "thread":
+        executor = ThreadPoolExecutor(workers, initializer=_init_thread)
+    else:
+        from gensound.signals import Raw
+        # forked workers inherit the loaded audio; otherwise it has to be sent to them
+        raw_cache = None if get_start_method() == "fork" else Raw.cache
+        executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(raw_cache,))
+    
+    with executor:
+        _executor, _threads = executor, scheduler == "thread"
+        try:
+            yield
+        finally:
+            _executor, _threads = None, False
+
+def _available():
+    """ returns the pool if work may be submitted to it from the current thread """
+    if _executor is None or getattr(_local, "worker", False):
+        return None # pool threads waiting on each other may deadlock
+    return _executor
+
+def _init_thread():
+    _local.worker = True
+
+def _init_worker(raw_cache):
+    global _executor
+    _executor = None # forked workers inherit the parent's; they should realise serially
+    
+    if raw_cache is not None:
+        from gensound.signals import Raw
+        Raw.cache.update(raw_cache)
+
+def _realise_shared(signal, sample_rate):
+    """ Runs in a worker process. Realises the signal into a new block of shared memory,
+    to be released by the parent.
+    """
+    audio = signal._realise(sample_rate)
+    shm = shared_memory.SharedMemory(create=True, size=max(audio.audio.nbytes, 1))
+    np.ndarray(audio.audio.shape, dtype=np.float64, buffer=shm.buf)[:,:] = audio.audio
+    resource_tracker.unregister(shm._name, "shared_memory") # otherwise removed when the worker exits
+    shm.close()
+    return (shm.name, audio.audio.shape, audio.shift)
+
+def _release(name):
+    shm = shared_memory.SharedMemory(name=name)
+    shm.close()
+    shm.unlink()
+
+def realise_each(signals, sample_rate):
+    """ Yields the realisations of signals in order.
+    When a pool is in use (and there is more than one signal), they are realised
+    in parallel in the worker processes; each Audio then resides in shared memory,
+    and is only valid until the next one is requested.
+    """
+    executor = _available()
+    
+    if executor is None or len(signals) < 2:
+        for signal in signals:
+            yield signal._realise(sample_rate)
+        return
+    
+    if _threads:
+        futures = [executor.submit(signal._realise, sample_rate) for signal in signals]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+        return
+    
+    futures = [executor.submit(_realise_shared, signal, sample_rate) for signal in signals]
+    consumed = 0
+    
+    try:
+        for (signal, future) in zip(signals, futures):
+            consumed += 1
+            
+            try:
+                (name, shape, shift) = future.result()
+            except Exception:
+                # most likely the signal can't be pickled (i.e. it contains a lambda);
+                # if the error was in realising it, it will occur again here
+                yield signal._realise(sample_rate)
+                continue
+            
+            shm = shared_memory.SharedMemory(name=name)
+            audio = Audio(sample_rate)
+            audio.audio = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+            audio.shift = shift
+            audio.shared = True # released once the next one is requested
+            
+            try:
+                yield audio
+            finally:
+                audio.audio = None # release the buffer, so the memory may be closed
+                shm.close()
+                shm.unlink()
+    finally:
+        for future in futures[consumed:]: # in case we were stopped midway
+            if not future.cancel() and future.exception() is None:
+                _release(future.result()[0])
+
+def map_channels(func, num_channels):
+    """ calls func(i) for each channel i, in parallel if a thread pool is in use.
+    func should only access its own channel.
+    """
+    executor = _available()
+    
+    if executor is None or not _threads or num_channels < 2:
+        for i in range(num_channels):
+            func(i)
+        return
+    
+    for future in [executor.submit(func, i) for i in range(num_channels)]:
+        future.result()
@@ -4,6 +4,14 @@
 _supported = set()
 _supported_bin = set()
 
+memmap_threshold = None
+""" Audio buffers of at least this many bytes are allocated as memory-mapped
+temporary files (see numpy.memmap) rather than in memory, for renders larger than RAM.
+None (default) keeps all audio in memory.
+"""
+
+memmap_dir = None # where the temporary files are kept; None for the system default
+
 def get_supported_modules():
     try:
         import pkg_resources
@@ -1,20 +1,27 @@
 # -*- coding: utf-8 -*-
 
 import copy
+import warnings
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, groupby
 
 import numpy as np
 
-from gensound.utils import isnumber, iscallable, num_samples
+from gensound.utils import isnumber, iscallable, num_samples, linspace_range, DB_to_Linear
 from gensound.musicTheory import parse_melody_to_signal, read_freq
 
-from gensound.transforms import Transform, TransformChain, Amplitude, Slice, Combine, BiTransform
+from gensound.transforms import Transform, TransformChain, Amplitude, Gain, Slice, Combine, BiTransform, \
+                                realise_fused
 from gensound.curve import Curve
 from gensound.audio import Audio
+from gensound.cache import structural_key
+from gensound import parallel
 
 #CHANNEL_NAMES = {"L":0, "R":1}
 
 
-__all__ = ["Signal", "Silence", "Step", "WhiteNoise", "Sine", "Triangle",
+__all__ = ["Signal", "Silence", "Step", "WhiteNoise", "PinkNoise", "ColoredNoise",
+           "BrownNoise", "BlueNoise", "VioletNoise", "Sine", "Triangle",
            "Square", "Sawtooth", "Raw", "WAV"]
 
 class Signal:
@@ -34,22 +41,184 @@ class Signal:
         """
         return np.zeros(shape=(1,0))
     
-    def realise(self, sample_rate):
+    shares_generated = False
+    """ Whether the array returned by generate() may be referenced elsewhere (e.g. cached),
+    in which case the realised Audio shares it, until it is modified in place (see Audio.shared).
+    Otherwise the realised Audio takes over the freshly generated array as its buffer.
+    """
+    
+    realisation_cache = None
+    """ An LRUCache (see gensound.cache) in which realised audio is stored by the structure
+    of the signal producing it, so identical sub-trees are only realised once.
+    Off by default; note that signals are then assumed to be reproducible,
+    unless they say otherwise in _cache_params().
+    """
+    
+    def realise(self, sample_rate, workers=None, scheduler="process"):
         """ returns Audio instance.
         parses the entire signal tree recursively
+        
+        if workers > 1, the signals of each Mix are realised in parallel
+        by that many worker processes, or threads if scheduler="thread" (see gensound.parallel).
+        """
+        if workers is not None:
+            with parallel.pool(workers, scheduler):
+                return self.realise(sample_rate)
+        
+        audio = self._realise(sample_rate)
+        audio.own() # the caller may modify it freely
+        return audio
+    
+    def _realise(self, sample_rate):
+        """ as realise(), except that the Audio returned may share its audio
+        with a cache (see Audio.shared), sparing a copy where it is only read,
+        as with sub-signals being mixed.
         """
+        cache = Signal.realisation_cache
+        key = None
+        
+        if cache is not None:
+            key = structural_key(self)
+            
+            if key is not None:
+                # as well as the class-level setting changing how transforms evaluate curves
+                key = (key, sample_rate, Curve.control_step)
+                audio = cache.get(key)
+                
+                if audio is not None:
+                    return audio._share()
+        
         audio = self.generate(sample_rate)
         
         if not isinstance(audio, Audio):
-            audio = Audio(sample_rate).from_array(audio)
+            audio = Audio(sample_rate).from_array(audio, copy=False)
+            audio.shared = self.shares_generated
     
-        for transform in self.transforms:
-            transform.realise(audio=audio)
+        for fusable, transforms in groupby(self.transforms,
+                                           key=lambda transform: transform.fusable and transform._stream_matches()):
+            transforms = list(transforms)
+            
+            if fusable and len(transforms) > 1:
+                audio.own()
+                realise_fused(transforms, audio)
+                continue
+            
+            for transform in transforms:
+                if transform.in_place:
+                    audio.own()
+                transform.realise(audio=audio)
+        
+        if key is not None:
+            base = audio.audio.base
+            if base is None or (isinstance(base, np.ndarray) and base.nbytes == audio.audio.nbytes):
+                cache.put(key, audio._share(), audio.audio.nbytes)
+            else: # a view (e.g. sliced or cropped) would keep all of its base alive
+                cache.put(key, audio.copy(), audio.audio.nbytes)
             
         return audio
     
+    def _cache_params(self):
+        """ returns whatever determines the output of realise() (usually all attributes),
+        by which the realisation cache identifies equal signals.
+        signals whose output can't be reproduced (i.e. random) should return None.
+        """
+        return vars(self)
+    
     mixdown = realise # TODO consider keeping just 1
     
+    def stream(self, sample_rate, block_size=2**14):
+        """ Generator yielding the signal as consecutive Audio blocks of block_size samples
+        (except possibly the last one), which together make up the same audio
+        that would be played or exported from realise().
+        
+        Signals and transforms are rendered a block at a time where they support it,
+        so memory depends on the block size rather than the duration of the signal.
+        Those which don't (see Transform.stream) are realised in full beforehand,
+        and are reported by a warning.
+        """
+        fallbacks = set()
+        (start, end, num_channels), source = self._stream(sample_rate, fallbacks)
+        
+        if fallbacks:
+            warnings.warn("Streaming not supported by: {}. These are realised in full prior to streaming."
+                          .format(", ".join(sorted(fallbacks))))
+        
+        # positive shift is padded with silence upon export, negative is kept
+        output = _mixing_source([(start, end, source)], num_channels)
+        
+        for position in range(min(start, 0), end, block_size):
+            block = output(position, min(block_size, end - position))
+            yield Audio(sample_rate).from_array(block, copy=False)
+    
+    def extent(self, sample_rate):
+        """ Returns (start, end, num_channels) of the Audio that realise() would return,
+        start and end being its absolute sample positions (audio.abs_start(), audio.abs_end()),
+        without realising anything. Returns None if this can't be known in advance.
+        """
+        extent = self._generate_extent(sample_rate)
+        
+        for transform in self.transforms:
+            if extent is None:
+                return None
+            extent = transform.extent(extent, sample_rate)
+        
+        return extent
+    
+    def _generate_extent(self, sample_rate):
+        """ Extent of the output of generate(), prior to any transforms.
+        Signals having duration are assumed to generate a mono signal of that duration;
+        override if that is not the case.
+        """
+        if type(self).generate is Signal.generate:
+            return (0, 0, 1)
+        
+        if hasattr(self, "duration"):
+            return (0, self.num_samples(sample_rate), 1)
+        
+        return None
+    
+    def _stream(self, sample_rate, fallbacks):
+        """ Returns (extent, source) for this signal, source(start, length) being
+        a function returning the samples [start, start+length) of the realised audio
+        as np.ndarray. The names of signals/transforms which had to be realised
+        in full are added to fallbacks.
+        """
+        stream = self._generate_stream(sample_rate, fallbacks)
+        culprit = self
+        
+        if stream is not None:
+            extent, source = stream
+            
+            for transform in self.transforms:
+                new_extent = transform.extent(extent, sample_rate)
+                source = None if new_extent is None or not transform._stream_matches() \
+                    else transform.stream(source, extent, sample_rate)
+                
+                if source is None:
+                    culprit = transform
+                    break
+                
+                extent = new_extent
+            else:
+                return (extent, source)
+        
+        fallbacks.add(type(culprit).__name__)
+        audio = self._realise(sample_rate) # only read from
+        
+        def source(start, length):
+            return audio.audio[:,start-audio.shift:start-audio.shift+length].copy()
+        
+        return ((audio.abs_start(), audio.abs_end(), audio.num_channels), source)
+    
+    def _generate_stream(self, sample_rate, fallbacks):
+        """ Streaming counterpart of generate(), returning (extent, source) as in _stream,
+        or None if the signal can't be generated piecewise.
+        """
+        if type(self).generate is Signal.generate:
+            return ((0, 0, 1), lambda start, length: np.zeros((1, length), dtype=np.float64))
+        
+        return None
+    
     def play(self, sample_rate=44100, **kwargs):
         audio = self.realise(sample_rate)
         return audio.play(**kwargs)
@@ -76,10 +245,14 @@ class Signal:
     def copy(self):
         """
         creates an identical signal object.
+        the copy shares its parameters, transforms and sub-signals with the original,
+        but not the lists holding them, so appending a transform to either one
+        (as in __setitem__) doesn't affect the other.
+        signals are never modified in place otherwise, so there is no need for a deep copy.
         """
-        # TODO perhaps deepcopy should be overridden to be thinner and faster,
-        # since it is performed often
-        return copy.deepcopy(self)
+        s = copy.copy(self)
+        s.transforms = list(self.transforms)
+        return s
     
     @staticmethod
     def concat(*args):
@@ -137,33 +310,11 @@ class Signal:
         if other is None:
             return self
         
-        if isnumber(other):
-            other = Silence(duration=other)
-            
         s = Sequence()
         # use isinstance(self, Sequence) instead? more semantic
         # TODO write this as overloading of Sequence operators instead?
-        if not self.transforms and isinstance(self, Sequence):
-            s.sequence += self.sequence
-        else:
-            s.sequence += [self]
-        
-        if isinstance(other, BiTransform): # if concatting BiTransform
-            s.sequence[-1] = s.sequence[-1]._apply(other.L)
-            s.sequence += [other.R]
-            return s
-        
-        if isinstance(s.sequence[-1], Transform): # if coming out of BiTransform
-            t = s.sequence.pop()
-        else:
-            t = None
-        
-        if not other.transforms and isinstance(other, Sequence):
-            other.sequence[0] = other.sequence[0]._apply(t)
-            s.sequence += other.sequence
-        else:
-            s.sequence += [other._apply(t)]
-        
+        s._append(self)
+        s._append(other)
         return s
     
     def _mix(self, other):
@@ -177,23 +328,16 @@ class Signal:
             other = other*DC(duration=self.duration)
         
         s = Mix()
-        
-        if not self.transforms and isinstance(self, Mix):
-            s.signals += self.signals
-        else:
-            s.signals += [self]
-        
-        if not other.transforms and isinstance(other, Mix):
-            s.signals += other.signals
-        else:
-            s.signals += [other]
-        
+        s._append(self)
+        s._append(other)
         return s
     
     def _repeat(self, number):
         # repeats this signal several times in a row
         assert isinstance(number, int)
-        return Signal.concat(*[self]*number)
+        if number < 2:
+            return Signal.concat(*[self]*number)
+        return Repeat(self, number)
     
     def _print_nice(self):
         if isinstance(self, Sequence):
@@ -342,6 +486,184 @@ class Signal:
         # 
         raise TypeError("May not iterate over Signal objects, as channel number is unknown prior to mixdown.")
 
+def _mixing_source(children, num_channels):
+    """ Streaming source summing the sources of several signals,
+    given as tuples (start, end, source) in order of mixing.
+    """
+    order = sorted(range(len(children)), key=lambda i: children[i][0])
+    starts = [children[i][0] for i in order]
+    longest = max([end - start for (start, end, source) in children], default=0)
+    
+    def source(start, length):
+        block = np.zeros((num_channels, length), dtype=np.float64)
+        # children overlapping the block must start within (start - longest, start + length)
+        overlapping = order[bisect_right(starts, start - longest):bisect_left(starts, start + length)]
+        
+        for i in sorted(overlapping): # retain order of summation
+            child_start, child_end, child_source = children[i]
+            begin, end = max(start, child_start), min(start + length, child_end)
+            if begin < end:
+                block[:,begin-start:end-start] += child_source(begin, end - begin)
+        
+        return block
+    
+    return source
+
+def _bank_factors(signal):
+    """ if signal is an oscillator of constant frequency, which is at most scaled
+    by its transforms, returns the factors by which it is scaled, in order.
+    otherwise returns None.
+    """
+    if not isinstance(signal, Oscillator) or not isnumber(signal.frequency) \
+        or type(signal).generate is not Oscillator.generate:
+        return None
+    
+    factors = []
+    for transform in signal.transforms:
+        if type(transform) is Amplitude and len(transform.amps) == 1 and isnumber(transform.amps[0]):
+            factors.append(transform.amps[0])
+        elif type(transform) is Gain and len(transform.dBs) == 1 and isnumber(transform.dBs[0]):
+            factors.append(DB_to_Linear(transform.dBs[0]))
+        else:
+            return None
+    
+    return factors
+
+def _mix_oscillators(oscillators, audio, sample_rate, block_size=2**16, max_rows=2**6):
+    """ mixes oscillators (for which _bank_factors is not None) into audio.
+    those with the same wave and duration are synthesized in a single computation,
+    for up to max_rows oscillators at a time, a block of samples at a time,
+    such that at most about block_size values are computed at once (bounding memory).
+    the result is identical to realising each of them and mixing them in order.
+    returns the end of the mixed audio.
+    """
+    nums = [oscillator.num_samples(sample_rate) for oscillator in oscillators]
+    length = max(nums)
+    # make room as Audio.conform would for each of them, all starting at 0
+    audio.push_forward(audio.abs_start())
+    audio.to_length(length - audio.abs_start())
+    
+    num_factors = max([len(oscillator.transforms) for oscillator in oscillators])
+    factors = np.ones((len(oscillators), num_factors)) # multiplying by 1 has no effect
+    for (i, oscillator) in enumerate(oscillators):
+        factors[i,:len(oscillator.transforms)] = _bank_factors(oscillator)
+    
+    frequencies = np.array([2*np.pi*oscillator.frequency for oscillator in oscillators])
+    increments = np.array([oscillator.frequency/sample_rate for oscillator in oscillators])
+    phases = np.array([oscillator._start_phase for oscillator in oscillators], dtype=np.float64)
+    
+    batches = [] # for each batch of rows, (class, num_samples, stop_time) -> row indices
+    for batch_start in range(0, len(oscillators), max_rows):
+        groups = {}
+        for i in range(batch_start, min(batch_start + max_rows, len(oscillators))):
+            duration = oscillators[i].duration
+            stop_time = duration/1000 if isinstance(duration, float) else duration/sample_rate # as in sample_times
+            groups.setdefault((type(oscillators[i]), nums[i], stop_time), []).append(i)
+        batches.append((batch_start, groups))
+    
+    # batches are mixed one after the other, which keeps the order of addition at each sample
+    for (batch_start, groups) in batches:
+        num_rows = sum([len(indices) for indices in groups.values()])
+        block_length = max(block_size // num_rows, 1)
+        
+        for block_start in range(0, length, block_length):
+            target = audio.audio[:,block_start-audio.abs_start():block_start-audio.abs_start()+block_length]
+            rows = {} # index -> its values in this block
+            
+            for (cls, num, stop_time), indices in groups.items():
+                available = min(block_length, num - block_start)
+                if available <= 0:
+                    continue
+                
+                times = linspace_range(stop_time, num, block_start, available)
+                values = np.multiply(frequencies[indices,np.newaxis], times)
+                values += phases[indices,np.newaxis]
+                values = cls._wave(values, increments[indices,np.newaxis])
+                
+                for j in range(num_factors):
+                    values *= factors[indices,j:j+1]
+                
+                rows.update(zip(indices, values))
+            
+            # add in order, as floating point addition is not associative
+            for i in sorted(rows):
+                target[:,:rows[i].shape[0]] += rows[i]
+    
+    return length
+
+def _is_note(signal):
+    """ whether signal is an oscillator of constant frequency or a silence, without transforms,
+    so it can be rendered together with neighbouring ones (see _render_notes).
+    """
+    if signal.transforms:
+        return False
+    if type(signal) is Silence:
+        return True
+    return isinstance(signal, Oscillator) and isnumber(signal.frequency) \
+        and type(signal).generate is Oscillator.generate
+
+def _render_notes(notes, phases, sample_rate, block_size=2**20):
+    """ renders a sequence of notes (for which _is_note is True),
+    given the phases inferred for them (see Sequence._start_phases).
+    the phase of each note, the frequency and time at each sample etc. are computed
+    for blocks of about block_size samples at once, rather than for each note separately;
+    the result is identical to realising them one by one.
+    returns the audio as a (1, samples) array.
+    """
+    classes = [] # of oscillators present
+    codes = [] # index in classes, -1 for silence
+    (start_phases, frequencies, increments, steps) = ([], [], [], [])
+    nums = [note.num_samples(sample_rate) for note in notes]
+    
+    for (note, phase, num) in zip(notes, phases, nums):
+        if type(note) is Silence:
+            codes.append(-1)
+            start_phases.append(0); frequencies.append(0); increments.append(0); steps.append(0)
+            continue
+        
+        if type(note) not in classes:
+            classes.append(type(note))
+        codes.append(classes.index(type(note)))
+        
+        start_phases.append(phase if note.phase is None else note.phase or 0) # as in _start_phase
+        stop_time = note.duration/1000 if isinstance(note.duration, float) \
+            else note.duration/sample_rate # as in sample_times
+        frequencies.append(2*np.pi * note.frequency)
+        increments.append(note.frequency/sample_rate)
+        steps.append(stop_time/num if num > 0 else 0) # as in linspace_range
+    
+    (codes, start_phases, frequencies, increments, steps) = \
+        (np.array(codes), np.array(start_phases, dtype=np.float64), np.array(frequencies, dtype=np.float64),
+         np.array(increments, dtype=np.float64), np.array(steps, dtype=np.float64))
+    offsets = np.concatenate(([0], np.cumsum(nums))) # where each note begins
+    audio = np.zeros((1, offsets[-1]), dtype=np.float64)
+    
+    first = 0
+    while first < len(notes): # notes [first, last) make up the current block
+        last = max(first + 1, np.searchsorted(offsets, offsets[first] + block_size, side="right") - 1)
+        per_sample = lambda values: np.repeat(values[first:last], nums[first:last])
+        
+        times = np.arange(offsets[first], offsets[last]) - per_sample(offsets)
+        times = times * per_sample(steps)
+        values = per_sample(frequencies)
+        values *= times
+        values = per_sample(start_phases) + values # phase first, as in Oscillator.generate
+        block = audio[0,offsets[first]:offsets[last]]
+        
+        for code in np.unique(codes[first:last]):
+            if code < 0:
+                continue # silence
+            
+            if (codes[first:last] == code).all():
+                block[:] = classes[code]._wave(values, per_sample(increments))
+            else:
+                where = per_sample(codes) == code
+                block[where] = classes[code]._wave(values[where], per_sample(increments)[where])
+        
+        first = last
+    
+    return audio
+
 #### other "high-level" signals ##############################3
 
 class Mix(Signal):
@@ -351,15 +673,85 @@ class Mix(Signal):
     """
     def __init__(self, *signals):
         super().__init__()
-        self.signals = list(signals)
+        self.signals = [signal.copy() for signal in signals]
+    
+    def copy(self):
+        s = super().copy()
+        s.signals = list(self.signals)
+        return s
+    
+    @classmethod
+    def from_iterable(cls, signals):
+        """ mixes the signals together, as would sum(signals),
+        but in linear time, rather than copying the mix so far for each signal.
+        unlike sum, the items must all be signals; numbers (DC) should be mixed in with +,
+        which gives them the duration of the signal they are added to.
+        """
+        s = cls()
+        for signal in signals:
+            s._append(signal)
+        return s
+    
+    def _append(self, other):
+        """ adds other to this mix in place, as in Signal._mix """
+        if not isinstance(other, Signal):
+            raise TypeError("Mix can only hold signals; mix numbers in with + instead.")
+        
+        if not other.transforms and isinstance(other, Mix):
+            self.signals += other.signals
+        else:
+            self.signals.append(other.copy()) # so that later changes to other don't affect us
     
     def generate(self, sample_rate):
         audio = Audio(sample_rate)
         
-        for signal in self.signals:
-            audio += signal.realise(sample_rate)
+        # allocate the entire mix in advance, so the signals are added in place
+        # rather than each of them padding (and copying) the audio so far
+        extent = self._generate_extent(sample_rate)
+        if extent is not None:
+            audio.allocate(*extent)
         
+        start, end = 0, 0 # what was actually mixed
+        
+        # consecutive plain oscillators are synthesized together, the rest one by one
+        for is_bank, signals in groupby(self.signals, key=lambda signal: _bank_factors(signal) is not None):
+            signals = list(signals)
+            
+            if is_bank and len(signals) > 1:
+                end = max(end, _mix_oscillators(signals, audio, sample_rate))
+                start = min(start, 0)
+                continue
+            
+            for child in parallel.realise_each(signals, sample_rate):
+                start, end = min(start, child.abs_start()), max(end, child.abs_end())
+                audio += child
+        
+        audio.crop(start, end) # in case the plan was off
         return audio
+    
+    def _generate_extent(self, sample_rate):
+        start, end, num_channels = 0, 0, 1 # as the empty Audio we mix into
+        
+        for signal in self.signals:
+            extent = signal.extent(sample_rate)
+            if extent is None:
+                return None
+            start, end = min(start, extent[0]), max(end, extent[1])
+            num_channels = max(num_channels, extent[2])
+        
+        return (start, end, num_channels)
+    
+    def _generate_stream(self, sample_rate, fallbacks):
+        start, end, num_channels = 0, 0, 1 # as the empty Audio we mix into
+        children = []
+        
+        for signal in self.signals:
+            (child_start, child_end, child_channels), source = signal._stream(sample_rate, fallbacks)
+            children.append((child_start, child_end, source))
+            start, end = min(start, child_start), max(end, child_end)
+            num_channels = max(num_channels, child_channels)
+        
+        return ((start, end, num_channels), _mixing_source(children, num_channels))
 
 class Sequence(Signal):
     """
@@ -367,26 +759,249 @@ class Sequence(Signal):
     """
     def __init__(self, *sequence):
         super().__init__()
-        self.sequence = list(sequence)
+        self.sequence = [signal.copy() for signal in sequence]
+    
+    def copy(self):
+        s = super().copy()
+        s.sequence = list(self.sequence)
+        return s
+    
+    @classmethod
+    def from_iterable(cls, signals):
+        """ concatenates the signals (and numbers, BiTransforms etc.) one after the other,
+        as would chaining them with |, but in linear time, rather than copying
+        the sequence so far for each of them.
+        """
+        s = cls()
+        for signal in signals:
+            s._append(signal)
+        return s
+    
+    def _append(self, other):
+        """ appends other to this sequence in place, as in Signal._concat """
+        if other is None:
+            return
+        
+        if isnumber(other):
+            other = Silence(duration=other)
+        
+        if isinstance(other, BiTransform): # if concatting BiTransform
+            self.sequence[-1] = self.sequence[-1]._apply(other.L)
+            self.sequence.append(other.R)
+            return
+        
+        if not other.transforms and isinstance(other, Sequence):
+            signals = list(other.sequence)
+        else:
+            signals = [other.copy()] # so that later changes to other don't affect us
+        
+        if signals and self.sequence and isinstance(self.sequence[-1], Transform): # if coming out of BiTransform
+            signals[0] = signals[0]._apply(self.sequence.pop())
+        
+        self.sequence += signals
     
     def generate(self, sample_rate):
         audio = Audio(sample_rate)
         
-        #### Phase Inference: TODO should this be here?
+        # allocate the entire sequence in advance, so each signal is written
+        # directly into its place rather than concatenated to the audio so far
+        extent = self._generate_extent(sample_rate)
+        if extent is not None:
+            audio.allocate(*extent)
         
-        phase = 0 # phase inference
+        start, end = 0, 0 # what was actually concatenated
         
-        for signal in self.sequence:
-            if isinstance(signal, Oscillator) and signal.phase is None:
-                signal._phase = phase
-                phase = (phase + signal.end_phase)%(2*np.pi) # phase inference
+        for child, lengths in self._realise_children(sample_rate):
+            # notes rendered together are contiguous, as concatenating them would place them,
+            # unless the audio already starts before 0; Audio.concat then leaves gaps between them
+            if lengths is None or start == 0:
+                children = [child]
             else:
-                phase = 0
+                positions = np.cumsum([0] + lengths)
+                children = [Audio(sample_rate).from_array(child.audio[:,begin:stop], copy=False)
+                            for (begin, stop) in zip(positions[:-1], positions[1:])]
             
-            audio.concat(signal.realise(sample_rate))
-            # TODO assymetric with Mix since we don't overload audio.concat
+            for child in children:
+                # same as audio.concat, except that audio may be longer than what we have so far
+                child.shift += end - start
+                start, end = min(start, child.abs_start()), max(end, child.abs_end())
+                
+                audio += child # if the plan was off, this grows the audio with headroom
         
+        audio.crop(start, end)
         return audio
+    
+    def _realise_children(self, sample_rate):
+        """ yields the realisations of the signals in order, inferring their phases,
+        as tuples (audio, lengths).
+        consecutive notes (see _is_note), such as those of a melody string,
+        are rendered together, yielding a single Audio for all of them,
+        along with the number of samples of each; otherwise lengths is None.
+        the others are realised in parallel if a pool is in use (see gensound.parallel).
+        """
+        phases = self._start_phases()
+        position = 0
+        
+        for is_note, signals in groupby(self.sequence, key=_is_note):
+            signals = list(signals)
+            run_phases = phases[position:position+len(signals)]
+            position += len(signals)
+            
+            if is_note and len(signals) > 1:
+                child = Audio(sample_rate)
+                child.audio = _render_notes(signals, run_phases, sample_rate)
+                yield (child, [signal.num_samples(sample_rate) for signal in signals])
+                continue
+            
+            for child in parallel.realise_each([Sequence._with_phase(signal, phase)
+                                                for (signal, phase) in zip(signals, run_phases)], sample_rate):
+                yield (child, None)
+    
+    def _generate_extent(self, sample_rate):
+        start, end, num_channels = 0, 0, 1
+        
+        for signal in self.sequence:
+            extent = signal.extent(sample_rate)
+            if extent is None:
+                return None
+            position = end - start # as in Audio.concat, placed after the current length
+            start, end = min(start, extent[0] + position), max(end, extent[1] + position)
+            num_channels = max(num_channels, extent[2])
+        
+        return (start, end, num_channels)
+    
+    def _start_phases(self):
+        """ phase inference: each oscillator whose phase is None continues from the phase
+        at which the previous signal ended (or 0, if that one did not infer its phase as well).
+        returns the phase at which each signal starts, computed in a single pass beforehand,
+        so the signals may then be realised independently of each other.
+        """
+        return list(accumulate(self.sequence[:-1], Sequence._next_phase, initial=0))
+    
+    @staticmethod
+    def _next_phase(phase, signal):
+        if isinstance(signal, Oscillator) and signal.phase is None:
+            return (phase + signal.end_phase)%(2*np.pi)
+        return 0
+    
+    @staticmethod
+    def _with_phase(signal, phase):
+        """ returns signal, starting at the given phase if it infers its phase.
+        the phase is set on a copy rather than on the tree, since the same signal
+        may appear in other sequences as well, which may be realised concurrently.
+        """
+        if isinstance(signal, Oscillator) and signal.phase is None:
+            signal = signal.copy()
+            signal._phase = phase
+        return signal
+    
+    def _generate_stream(self, sample_rate, fallbacks):
+        start, end, num_channels = 0, 0, 1
+        children = []
+        
+        for (signal, phase) in zip(self.sequence, self._start_phases()):
+            signal = Sequence._with_phase(signal, phase)
+            (child_start, child_end, child_channels), source = signal._stream(sample_rate, fallbacks)
+            
+            # as in Audio.concat, the signal is placed after the current length
+            position = end - start
+            children.append((child_start + position, child_end + position,
+                             lambda start, length, source=source, position=position: source(start - position, length)))
+            start, end = min(start, child_start + position), max(end, child_end + position)
+            num_channels = max(num_channels, child_channels)
+        
+        return ((start, end, num_channels), _mixing_source(children, num_channels))
+
+class Repeat(Sequence):
+    """
+    a signal placed several times one after the other (signal**number).
+    the signal is realised once and copied into place, rather than realised
+    for each repetition; oscillators with phase inference are realised once
+    for each distinct phase they start at.
+    """
+    def __init__(self, signal, number):
+        super().__init__(signal)
+        self.sequence *= number # the same object, so the Sequence can tell it is repeated
+    
+    def _repeated(self):
+        """ returns the repeated signal, or None if this is no longer a plain repetition
+        (in which case we treat it as any Sequence).
+        """
+        if not self.sequence or any([signal is not self.sequence[0] for signal in self.sequence]):
+            return None
+        return self.sequence[0]
+    
+    def generate(self, sample_rate):
+        signal = self._repeated()
+        extent = None if signal is None else signal.extent(sample_rate)
+        
+        if signal is None or (extent is not None and extent[0] < 0):
+            return super().generate(sample_rate) # repetitions may overlap
+        
+        children = {} # by starting phase, or None if not inferred
+        tiles = [] # the render used for each repetition
+        
+        for phase in self._start_phases():
+            child = Sequence._with_phase(signal, phase)
+            key = None if child is signal else phase
+            children.setdefault(key, child)
+            tiles.append(key)
+        
+        audio = None
+        
+        # each render is only valid until the next one is requested (see parallel.realise_each)
+        for key, render in zip(children, parallel.realise_each(list(children.values()), sample_rate)):
+            shape = (render.abs_start(), render.abs_end(), render.num_channels)
+            
+            if audio is None:
+                (start, period, num_channels) = first_shape = shape
+                
+                if start < 0: # unknown extent turned out unsuitable
+                    return super().generate(sample_rate)
+                
+                # as in Sequence.generate, each repetition is placed at the end of the previous one
+                audio = Audio(sample_rate).allocate(0, len(tiles)*period, num_channels)
+                repetitions = audio.audio.reshape((num_channels, len(tiles), period))
+            elif shape != first_shape:
+                return super().generate(sample_rate)
+            
+            indices = [i for i in range(len(tiles)) if tiles[i] == key]
+            repetitions[:,indices,start:] = render.audio[:,np.newaxis,:]
+        
+        return audio
+    
+    def _generate_extent(self, sample_rate):
+        signal = self._repeated()
+        extent = None if signal is None else signal.extent(sample_rate)
+        
+        if extent is None or extent[0] < 0:
+            return super()._generate_extent(sample_rate)
+        
+        return (0, len(self.sequence)*extent[1], extent[2])
+    
+    def _generate_stream(self, sample_rate, fallbacks):
+        signal = self._repeated()
+        
+        if signal is None or Sequence._with_phase(signal, 0) is not signal:
+            return super()._generate_stream(sample_rate, fallbacks) # each is generated differently
+        
+        (start, period, num_channels), child_source = signal._stream(sample_rate, fallbacks)
+        
+        if start < 0:
+            return super()._generate_stream(sample_rate, fallbacks)
+        
+        def source(block_start, length):
+            block = np.zeros((num_channels, length), dtype=np.float64)
+            
+            for i in range(block_start // period, (block_start + length - 1) // period + 1):
+                begin = max(block_start, i*period + start)
+                end = min(block_start + length, (i+1)*period)
+                if begin < end:
+                    block[:,begin-block_start:end-block_start] = child_source(begin - i*period, end - begin)
+            
+            return block
+        
+        return ((0, len(self.sequence)*period, num_channels), source)
 
 #### particular signals #########
 
@@ -397,6 +1012,12 @@ class Silence(Signal):
     
     def generate(self, sample_rate):
         return np.zeros(self.num_samples(sample_rate), dtype=np.float64)
+    
+    def _generate_stream(self, sample_rate, fallbacks):
+        if type(self).generate is not Silence.generate: # unless overridden
+            return None
+        return ((0, self.num_samples(sample_rate), 1),
+                lambda start, length: np.zeros((1, length), dtype=np.float64))
 
 class Step(Signal): # Impulse? DC?
     def __init__(self, duration=1):
@@ -405,56 +1026,147 @@ class Step(Signal): # Impulse? DC?
     
     def generate(self, sample_rate):
         return np.ones((self.num_samples(sample_rate),), dtype=np.float64)
+    
+    def _generate_stream(self, sample_rate, fallbacks):
+        if type(self).generate is not Step.generate:
+            return None
+        return ((0, self.num_samples(sample_rate), 1),
+                lambda start, length: np.ones((1, length), dtype=np.float64))
 
 DC = Step
 
 ## TODO step with frequency
 
-class WhiteNoise(Signal):
-    def __init__(self, duration=5e3):
-        # TODO add seed argument?
+class Noise(Signal):
+    """
+    superclass of random signals.
+    each one has a seed (chosen randomly unless given), which determines its audio,
+    so realising it again, at any time or in any process, gives the same result.
+    copies (i.e. each occurrence of the noise in a signal, as in n*Pan(-100) + n*Pan(100))
+    draw independent numbers, derived from the seed and the number of copies made before,
+    so building the same signal again gives the same audio as well.
+    (noises inside a mix or sequence that is itself reused are shared, since so are its signals.)
+    
+    random numbers are drawn from independent streams spawned from the seed,
+    each one covering a block of samples, so any range of samples may be generated
+    on its own (i.e. when streaming), identically to the complete signal.
+    """
+    block_size = 2**16 # samples covered by each random stream
+    
+    def __init__(self, duration=5e3, seed=None):
         super().__init__()
         self.duration = duration
+        self.seed = np.random.SeedSequence().entropy if seed is None else seed
+        self.spawn_key = () # identifies this copy of the noise, see copy()
+        self._copies = 0
+    
+    def copy(self):
+        s = super().copy()
+        s.spawn_key = self.spawn_key + (self._copies,)
+        s._copies = 0
+        self._copies += 1
+        return s
+    
+    def _cache_params(self):
+        # the number of copies made doesn't change the output
+        return {name: value for name, value in vars(self).items() if name != "_copies"}
+    
+    def _generator(self, *key):
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=self.spawn_key + key))
     
+    def random(self, start, length, stream=0):
+        """ returns the uniform random numbers in [0,1) for samples [start, start+length).
+        different streams give independent sequences.
+        """
+        blocks = []
+        
+        for i in range(start // Noise.block_size, -(-(start + length) // Noise.block_size)):
+            begin = max(start, i*Noise.block_size) - i*Noise.block_size
+            end = min(start + length, (i+1)*Noise.block_size) - i*Noise.block_size
+            blocks.append(self._generator(stream, i).random(end)[begin:])
+        
+        return np.concatenate(blocks) if blocks else np.zeros(0)
+
+class WhiteNoise(Noise):
     def generate(self, sample_rate):
         # TODO this may have non-zero DC!
-        return 2*np.random.rand(self.num_samples(sample_rate)) - 1
-
-class PinkNoise(Signal):
-    def __init__(self, duration=5e3):
-        super().__init__()
-        self.duration = duration
+        return 2*self.random(0, self.num_samples(sample_rate)) - 1
     
+    def _generate_stream(self, sample_rate, fallbacks):
+        if type(self).generate is not WhiteNoise.generate:
+            return None
+        return ((0, self.num_samples(sample_rate), 1),
+                lambda start, length: (2*self.random(start, length) - 1).reshape((1, length)))
+
+class PinkNoise(Noise):
     def generate(self, sample_rate):
         # Adapted from Larry Trammell (https://www.ridgerat-tech.us/pink/pinkalg.htm)
         av = [ 4.6306e-003,  5.9961e-003,  8.3586e-003 ]
         pv = [ 3.1878e-001,  7.7686e-001,  9.7785e-001  ]
-    
-        # Initialize the randomized sources state
-        randreg = np.zeros_like(av)
-      
-        for i in range(len(av)):
-            randreg[i] = av[i]*2*(np.random.rand() - 0.5)
         
-        sig = np.zeros(self.num_samples(sample_rate))
+        length = self.num_samples(sample_rate)
+        rv = self.random(0, length) # decides which of the sources are updated at each sample
+        sig = np.zeros(length)
         
-        for i in range(len(sig)):
-            rv = np.random.rand()
-            
-            for ii in range(len(av)):
-                if rv > pv[ii]:
-                    randreg[ii] = av[ii]*2*(np.random.rand() - 0.5)
-            sig[i] = sum(randreg)
+        for stream, (a, p) in enumerate(zip(av, pv), 1):
+            # the randomized source holds its initial value until its first update,
+            # and each updated value until the next update
+            updates = rv > p
+            values = a*2*(self.random(0, np.count_nonzero(updates) + 1, stream) - 0.5)
+            sig += values[np.cumsum(updates)]
         
         return sig / np.max(np.abs(sig))
 
-# TODO add other colors of noise
+class ColoredNoise(Noise):
+    """
+    noise whose power spectral density is proportional to f**exponent,
+    made by shaping white noise in the frequency domain (DC is removed),
+    and normalized to a peak amplitude of 1.
+    
+    exponent is 0 for white noise, -1 for pink (see also PinkNoise),
+    and for the subclasses: -2 for brown, 1 for blue and 2 for violet.
+    """
+    exponent = 0
+    
+    def __init__(self, duration=5e3, exponent=None, seed=None):
+        super().__init__(duration, seed)
+        self.exponent = type(self).exponent if exponent is None else exponent
+    
+    def generate(self, sample_rate):
+        length = self.num_samples(sample_rate)
+        if length == 0:
+            return np.zeros(0)
+        
+        spectrum = np.fft.rfft(self._generator().standard_normal(length))
+        
+        frequencies = np.fft.rfftfreq(length, 1/sample_rate)
+        shape = np.zeros_like(frequencies)
+        shape[1:] = frequencies[1:] ** (self.exponent/2) # amplitude, i.e. square root of power
+        
+        sig = np.fft.irfft(spectrum * shape, length)
+        peak = np.max(np.abs(sig), initial=0)
+        return sig / peak if peak > 0 else sig
+
+class BrownNoise(ColoredNoise): # AKA red noise
+    exponent = -2
+
+class BlueNoise(ColoredNoise):
+    exponent = 1
+
+class VioletNoise(ColoredNoise):
+    exponent = 2
+
 
 #### simple oscillators
 
 
 class Oscillator(Signal): # virtual superclass
     wave = lambda phase: 0 # phase -> amplitude; subclass should implement this
+    band_limited_wave = None # (phase, increment) -> amplitude, with increment in cycles per sample
+    band_limited = False
+    """ Set to True (on Oscillator or on a particular subclass) to use band_limited_wave
+    where available, which is free of most of the aliasing of the naive wave.
+    """
     
     def __new__(cls, frequency=220, duration=5e3, phase=None):
         # TODO maybe deal with *args, **kwds for more flexibility
@@ -506,27 +1218,120 @@ class Oscillator(Signal): # virtual superclass
         # or better, having CompoundCurve give the extra argument telling its
         # children NOT to lose the last sample
         
+        phase = self._start_phase
+        
+        if isinstance(self.frequency, Curve):
+            cycles = self.frequency.integral(sample_rate)
+            return type(self)._wave(phase + 2*np.pi * cycles[:-1], np.diff(cycles))
+        return type(self)._wave(phase + 2*np.pi * self.frequency * self.sample_times(sample_rate),
+                                self.frequency/sample_rate)
+    
+    @classmethod
+    def _wave(cls, phase, increment):
+        if cls.band_limited and cls.band_limited_wave is not None:
+            return cls.band_limited_wave(phase, increment)
+        return cls.wave(phase)
+    
+    def _cache_params(self):
+        # the class-level setting changes the output as well
+        return {**vars(self), "band_limited": type(self).band_limited}
+    
+    @property
+    def _start_phase(self):
         if hasattr(self, "_phase") and self.phase is None: # phase inference
-            phase = self._phase
-        else:
-            phase = self.phase or 0
+            return self._phase
+        return self.phase or 0
+    
+    def _generate_extent(self, sample_rate):
+        if isinstance(self.frequency, Curve):
+            return (0, self.frequency.num_samples(sample_rate), 1)
+        return (0, self.num_samples(sample_rate), 1)
+    
+    def _generate_stream(self, sample_rate, fallbacks):
+        if type(self).generate is not Oscillator.generate:
+            return None # the override can only be realised in full
         
         if isinstance(self.frequency, Curve):
-            return type(self).wave(phase + 2*np.pi * self.frequency.integral(sample_rate)[:-1])
-        return type(self).wave(phase + 2*np.pi * self.frequency * self.sample_times(sample_rate))
+            return None # phase is the integral over the entire curve
+        
+        phase = self._start_phase # fix it now; the sequence may infer another later
+        num = self.num_samples(sample_rate)
+        stop_time = self.duration/1000 if isinstance(self.duration, float) \
+            else self.duration/sample_rate # as in sample_times
+        
+        def source(start, length):
+            times = linspace_range(stop_time, num, start, length)
+            return type(self)._wave(phase + 2*np.pi * self.frequency * times,
+                                    self.frequency/sample_rate).reshape((1, length))
+        
+        return ((0, num, 1), source)
         
 
+# band-limited waves: the naive wave, corrected near each discontinuity (PolyBLEP),
+# or each corner (PolyBLAMP), over the two samples surrounding it.
+# positions are in cycles, within [0, 1), where 0 is the discontinuity.
+
+def _polyblep(out, position, increment, height):
+    """ adds to out the residual of a band-limited step of the given height """
+    increment = np.broadcast_to(np.minimum(np.abs(increment), 0.5), position.shape)
+    
+    after = position < increment # first sample after the step
+    x = position[after]/increment[after]
+    out[after] -= height*(x - 1)**2/2
+    
+    before = position > 1 - increment # last sample before the step
+    x = (position[before] - 1)/increment[before]
+    out[before] += height*(x + 1)**2/2
+
+def _polyblamp(out, position, increment, slope):
+    """ adds to out the residual of a band-limited corner, slope being the change
+    in the derivative (per cycle)
+    """
+    increment = np.broadcast_to(np.minimum(np.abs(increment), 0.5), position.shape)
+    
+    after = position < increment
+    x = position[after]/increment[after] - 1
+    out[after] -= slope*increment[after]*x**3/6
+    
+    before = position > 1 - increment
+    x = (position[before] - 1)/increment[before] + 1
+    out[before] += slope*increment[before]*x**3/6
+
+def _band_limited_square(phase, increment):
+    position = (phase/(2*np.pi)) % 1
+    out = np.where(position < 0.5, 1.0, -1.0)
+    _polyblep(out, position, increment, 2)
+    _polyblep(out, (position + 0.5) % 1, increment, -2)
+    return out
+
+def _band_limited_sawtooth(phase, increment):
+    position = (phase/(2*np.pi) + 0.5) % 1
+    out = 2*position - 1
+    _polyblep(out, position, increment, -2)
+    return out
+
+def _band_limited_triangle(phase, increment):
+    position = (phase/(2*np.pi) - 0.25) % 1 # 0 is the peak
+    out = np.abs(4*position - 2) - 1
+    _polyblamp(out, position, increment, -8)
+    _polyblamp(out, (position + 0.5) % 1, increment, 8)
+    return out
+
+
 class Sine(Oscillator): # oscillator? pitch? phaser?
     wave = np.sin
 
 class Triangle(Oscillator): # TODO start at 0, not 1
     wave = lambda phase: 2*np.abs(((phase-0.5*np.pi) % (2*np.pi) - np.pi))/np.pi - 1
+    band_limited_wave = _band_limited_triangle
     
 class Square(Oscillator):
     wave = lambda phase: ((phase % (2*np.pi) < np.pi)*2 - 1).astype(np.float64)
+    band_limited_wave = _band_limited_square
 
 class Sawtooth(Oscillator):
     wave = lambda phase: ((phase+np.pi) % (2*np.pi))/np.pi-1
+    band_limited_wave = _band_limited_sawtooth
 
 # TODO sweepsine, periodic impulse
 
@@ -539,19 +1344,29 @@ class Raw(Signal):
     we should probably use a view until we start applying transforms.
     I.e. this object should only keep a view, and on generate it should copy.
     """
+    shares_generated = True # generate() returns the cached array, copied only once modified
+    
     def __init__(self, audio=None):
         super().__init__()
         
         if audio != None:
-            if not hasattr(self, "key"):
-                self.key = f"Raw_{len(Raw.cache)}"
-            
-            if self._key() not in Raw.cache:
-                Raw.cache[self._key()] = audio
+            # the cache holds a copy, as the audio it hands out is shared rather than copied
+            self._store(audio.copy())
+    
+    def _store(self, audio):
+        if not hasattr(self, "key"):
+            self.key = f"Raw_{len(Raw.cache)}"
+        
+        if self._key() not in Raw.cache:
+            Raw.cache[self._key()] = audio
         
     def _key(self): # TODO __key__ ?
         return type(self).__name__ + ":" + str(self.key)
     
+    def _cache_params(self):
+        # the audio itself is not an attribute; its array identifies it (it is replaced on resample)
+        return {**vars(self), "audio": self.audio.audio, "sample_rate": self.audio.sample_rate}
+    
     def resample(self, sample_rate=44100, method="quadratic"):
         # TODO maybe copy resampled audio under new key which indicates the sample rate change
         # but to do that we need to decide if we clear the previous version from cache,
@@ -570,6 +1385,16 @@ class Raw(Signal):
     def generate(self, sample_rate):
         #return np.copy(self.audio.audio)
         return self.audio.audio
+    
+    def _generate_extent(self, sample_rate):
+        return (0, self.audio.length, self.audio.num_channels)
+    
+    def _generate_stream(self, sample_rate, fallbacks):
+        if type(self).generate is not Raw.generate:
+            return None
+        audio = self.audio.audio
+        return ((0, audio.shape[1], audio.shape[0]),
+                lambda start, length: audio[:,start:start+length].copy())
     """
     TODO
     ####think about this more. here we're copying the audio data,
@@ -602,13 +1427,10 @@ class WAV(Raw):
         # or adding counter for number of copies of base key
         self.key = f"WAV_{filename}"
         
-        audio = None
+        super().__init__()
         
         if self._key() not in Raw.cache:
-            audio = Audio.from_file(filename)
-        
-        # TODO copy again? so the cache will be eternally independent?
-        super().__init__(audio)
+            self._store(Audio.from_file(filename)) # nothing else refers to it, no need to copy
     
 
 
@@ -5,9 +5,10 @@ import numpy as np
 from gensound.settings import _supported
 from gensound.curve import Curve, Line, Logistic, Constant
 from gensound.audio import Audio
+from gensound import parallel
 from gensound.utils import lambda_to_range, DB_to_Linear, \
                   isnumber, iscallable, \
-                  num_samples, samples_slice, sec
+                  num_samples, samples_slice, sec, linspace_range
 
 __all__ = ["Transform", "Shift", "Extend", "Reverse", "Fade", "FadeIn", "FadeOut", "CrossFade",
            "Gain", "SineAM", "Limiter", "Mono", "Pan", "Repan",
@@ -23,6 +24,19 @@ class Transform:
     
     """
     
+    fusable = False
+    """ True for transforms which scale each sample independently of the others,
+    keeping the extent unchanged, and whose stream() gives exactly the same result as realise().
+    Consecutive fusable transforms are applied together, block by block (see realise_fused),
+    unless a subclass overrides realise() but not stream() (see _stream_matches).
+    """
+    
+    in_place = True
+    """ Whether realise() may modify the samples of the audio in place, in which case
+    audio shared with others (see Audio.shared) is copied first.
+    Transforms which only replace audio.audio (e.g. by a slice of it) or move it set this to False.
+    """
+    
     def __init__(self):
         # TODO consider using *kwargs and making it copy all attributes to self
         # this would save us many inherited inits simply doing self.duration = duration
@@ -62,6 +76,66 @@ class Transform:
         this should change the object directly, don't return anything."""
         pass
 
+    def extent(self, extent, sample_rate):
+        """ receives the extent (start, end, num_channels) of the audio prior to realise(),
+        start and end being its absolute sample positions (audio.abs_start(), audio.abs_end()),
+        and returns the extent it would have afterwards, or None if this can't be
+        known without actually realising.
+        By default transforms are assumed to keep all of these unchanged;
+        override if that is not the case.
+        """
+        return extent
+    
+    def _stream_matches(self):
+        """ whether stream() is defined along with realise(), rather than inherited
+        by a subclass which overrides only realise(), in which case it can't be used instead.
+        """
+        owner = lambda name: next(cls for cls in type(self).__mro__ if name in vars(cls))
+        return owner("realise") is owner("stream")
+    
+    def stream(self, source, extent, sample_rate):
+        """ streaming counterpart of realise().
+        source(start, length) returns an np.ndarray with the samples [start, start+length)
+        of the audio prior to this transform (whose extent is given),
+        which may be modified in place.
+        Should return a function of the same form, giving the transformed audio.
+        It will only be called for ranges within self.extent(extent, sample_rate).
+        
+        Returns None if the transform can only be applied to the complete audio,
+        in which case the signal falls back to being realised before streaming.
+        """
+        return None
+
+def _check_fits(transform, num_samples, num_values):
+    """ realise() multiplies num_values values into num_samples samples of the audio in place,
+    which numpy only allows if they are as many, or there is just one;
+    stream() checks the same, so that the transform rejects the same audio either way.
+    """
+    if num_values not in (num_samples, 1):
+        raise ValueError(f"{type(transform).__name__}: can't apply {num_values} values "
+                         f"to {num_samples} samples of audio.")
+
+def realise_fused(transforms, audio, block_size=2**13):
+    """ applies several fusable transforms to audio one block at a time,
+    so each block passes through all of them while it is still in cache,
+    and temporaries are the size of a block rather than of the entire audio.
+    the result is identical to realising them one after the other.
+    """
+    extent = (audio.abs_start(), audio.abs_end(), audio.num_channels)
+    # blocks are views into the audio, to be transformed in place
+    source = lambda start, length: audio.audio[:,start-extent[0]:start-extent[0]+length]
+    
+    for transform in transforms:
+        source = transform.stream(source, extent, audio.sample_rate)
+    
+    for start in range(extent[0], extent[1], block_size):
+        length = min(block_size, extent[1] - start)
+        block = source(start, length)
+        target = audio.audio[:,start-extent[0]:start-extent[0]+length]
+        
+        if not np.may_share_memory(block, target): # wasn't done in place
+            target[:,:] = block
+
 ####### High-level transforms ################
 
 class TransformChain(Transform):
@@ -100,6 +174,8 @@ class Slice(Transform):
     
     # TODO if hell froze over maybe its possible to merge this with Combine
     """
+    in_place = False
+    
     def __init__(self, channel_slice, time_slice):
         # TODO filter slices (if relevant?)
         self.channel_slice = channel_slice
@@ -112,6 +188,35 @@ class Slice(Transform):
                                   samples_slice(self.time_slice, audio.sample_rate)]
         assert audio.ensure_2d(), "pbbly channel_slice wasn't a slice, so not ensure_2d()"
 
+    def _num_channels(self, num_channels):
+        # number of channels prior to slicing (mono may be expanded first, see realise)
+        if num_channels == 1 and self.channel_slice.start == 0 and self.channel_slice.stop > 0:
+            return self.channel_slice.stop
+        return num_channels
+    
+    def extent(self, extent, sample_rate):
+        start, end, num_channels = extent
+        time_slice = samples_slice(self.time_slice, sample_rate)
+        num_channels = self._num_channels(num_channels)
+        return (start, start + len(range(end - start)[time_slice]),
+                len(range(num_channels)[self.channel_slice]))
+    
+    def stream(self, source, extent, sample_rate):
+        time_slice = samples_slice(self.time_slice, sample_rate)
+        if time_slice.step not in (None, 1):
+            return None
+        
+        offset = range(extent[1] - extent[0])[time_slice].start
+        num_channels = self._num_channels(extent[2])
+        
+        def block(start, length):
+            audio = source(start + offset, length)
+            if audio.shape[0] != num_channels:
+                audio = np.repeat(audio, num_channels, axis=0)
+            return audio[self.channel_slice,:]
+        
+        return block
+
 class Combine(Transform):
     """ given another Signal as input, realises it and pushes it back
     into the affected signal in the relevant place.
@@ -130,7 +235,7 @@ class Combine(Transform):
     
     def realise(self, audio):
         # prepare new audio and ensure shift can only be negative
-        new_audio = self.signal.realise(audio.sample_rate)
+        new_audio = self.signal._realise(audio.sample_rate)
         new_audio.push_forward(new_audio.shift)
         
         # locating correct samples
@@ -151,6 +256,20 @@ class Combine(Transform):
         # put inside; recall that new_audio.shift <= 0
         audio.audio[self.channel_slice, start_sample:start_sample+new_audio.length+new_audio.shift] += new_audio.audio[:,-new_audio.shift:]
 
+    def extent(self, extent, sample_rate):
+        inner = self.signal.extent(sample_rate)
+        if inner is None:
+            return None
+        
+        start, end, num_channels = extent
+        sample_slice = samples_slice(self.time_slice, sample_rate)
+        start_sample = sample_slice.start if sample_slice.start is not None else 0
+        max_channel = max(0, self.channel_slice.start or 0, (self.channel_slice.stop or 0)-1)
+        # see realise; inner audio is pushed forward by its shift if positive
+        length = inner[1] - min(inner[0], 0)
+        return (start, start + max(end - start, start_sample + length),
+                max(num_channels, max_channel+1))
+
 
 ####### Basic shape stuff ##############
 
@@ -158,21 +277,48 @@ class Shift(Transform):
     """ shifts the signal forward in time."""
     # TODO enable backward
     # TODO doesn't seem to work when its a forward shift for the first signal in the mix
+    in_place = False
+    
     def __init__(self, duration):
         self.duration = duration
     
     def realise(self, audio):
         audio.shift += self.num_samples(audio.sample_rate)
 
+    def extent(self, extent, sample_rate):
+        start, end, num_channels = extent
+        shift = self.num_samples(sample_rate)
+        return (start + shift, end + shift, num_channels)
+    
+    def stream(self, source, extent, sample_rate):
+        shift = self.num_samples(sample_rate)
+        return lambda start, length: source(start - shift, length)
+
 class Extend(Transform):
     """ adds silence after the signal. needed?
     """
+    in_place = False # Audio.extend reallocates shared audio anyway
+    
     def __init__(self, duration):
         self.duration = duration
     
     def realise(self, audio):
         audio.extend(self.num_samples(audio.sample_rate))
 
+    def extent(self, extent, sample_rate):
+        start, end, num_channels = extent
+        return (start, end + self.num_samples(sample_rate), num_channels)
+    
+    def stream(self, source, extent, sample_rate):
+        def block(start, length):
+            audio = np.zeros((extent[2], length), dtype=np.float64)
+            available = min(length, extent[1] - start)
+            if available > 0:
+                audio[:,:available] = source(start, available)
+            return audio
+        
+        return block
+
 class Reverse(Transform):
     """
     reverses the signal
@@ -187,6 +333,8 @@ class Fade(Transform):
     """ Adds Fade In / Out to the signal with different curve presets.
     This is the superclass of FadeIn and FadeOut; use those instead.
     """
+    fusable = True
+    
     def __init__(self, is_in=True, duration=1e3, curve="linear", *,  degree=2):
         assert curve in ("linear", "polynomial")
         self.is_in = is_in
@@ -194,11 +342,14 @@ class Fade(Transform):
         self.curve = curve
         self.degree = degree
 
-    def realise(self, audio):
+    def _amp(self, sample_rate):
         if self.curve == "linear":
-            amp = np.linspace(0, 1, self.num_samples(audio.sample_rate))
+            return np.linspace(0, 1, self.num_samples(sample_rate))
         elif self.curve == "polynomial":
-            amp = (np.linspace(0, 1, self.num_samples(audio.sample_rate))) ** self.degree
+            return (np.linspace(0, 1, self.num_samples(sample_rate))) ** self.degree
+    
+    def realise(self, audio):
+        amp = self._amp(audio.sample_rate)
         
         # fade in/out handler
         if self.is_in:
@@ -209,6 +360,28 @@ class Fade(Transform):
         # TODO in case of fade out, if amp is shorter or longer than audio,
         # care must be taken when multiplying!
 
+    def stream(self, source, extent, sample_rate):
+        amp = self._amp(sample_rate)
+        length_total = extent[1] - extent[0]
+        # the samples realise() multiplies; note that audio[:,-0:] is all of them
+        applied = length_total if len(amp) == 0 and not self.is_in else min(len(amp), length_total)
+        _check_fits(self, applied, len(amp))
+        # sample position (relative to the start of the audio) where the fade begins
+        fade_start = 0 if self.is_in else length_total - len(amp)
+        if not self.is_in:
+            amp = amp[::-1]
+        
+        def block(start, length):
+            audio = source(start, length)
+            offset = start - extent[0]
+            begin = max(offset, fade_start)
+            end = min(offset + length, fade_start + len(amp))
+            if begin < end:
+                audio[:,begin-offset:end-offset] *= amp[begin-fade_start:end-fade_start]
+            return audio
+        
+        return block
+
 class FadeIn(Fade):
     """ Apply fade in to the signal, for the required duration and curve type.
 
@@ -241,6 +414,8 @@ class Gain(Transform):
     """
     Adds positive/negative gain in dBs to the signal.
     """
+    fusable = True
+    
     def __init__(self, *dBs):
         self.dBs = dBs
     
@@ -257,12 +432,29 @@ class Gain(Transform):
             if isnumber(dB):
                 audio.audio[i,:] *= DB_to_Linear(dB)
             elif isinstance(dB, Curve):
-                vals = DB_to_Linear(dB.flatten(audio.sample_rate))
+                vals = dB.evaluate(audio.sample_rate, DB_to_Linear)
                 audio.audio[i,0:dB.num_samples(audio.sample_rate)] *= vals
                 audio.audio[i,dB.num_samples(audio.sample_rate):] *= DB_to_Linear(dB.endpoint())
             else:
                 raise TypeError("Unsupported amplitude type")
 
+    def stream(self, source, extent, sample_rate):
+        dBs = self.dBs * extent[2] if len(self.dBs) == 1 and extent[2] > 1 else self.dBs
+        # per-channel gains, as in realise: either a number,
+        # or the curve values along with the gain that follows them
+        gains = []
+        
+        for dB in dBs:
+            if isnumber(dB):
+                gains.append(DB_to_Linear(dB))
+            elif isinstance(dB, Curve):
+                gains.append((dB.evaluate(sample_rate, DB_to_Linear), DB_to_Linear(dB.endpoint())))
+                _check_fits(self, min(dB.num_samples(sample_rate), extent[1] - extent[0]), len(gains[-1][0]))
+            else:
+                raise TypeError("Unsupported amplitude type")
+        
+        return _gain_block(source, extent, gains)
+
 class Amplitude(Transform):
     """ simple increase/decrease of amplitude.
     for constant amplitude, don't use this directly;
@@ -271,6 +463,8 @@ class Amplitude(Transform):
     
     use Gain() to change in dB
     """
+    fusable = True
+    
     def __init__(self, *amps):
         self.amps = amps
     
@@ -290,7 +484,7 @@ class Amplitude(Transform):
             if isnumber(amp):
                 audio.audio[i,:] *= amp
             elif isinstance(amp, Curve):
-                vals = amp.flatten(audio.sample_rate)
+                vals = amp.evaluate(audio.sample_rate)
                 # TODO view or copy?
                 # TODO what if curve duration doesn't match signal?
                 # or can we have curve duration extracted from signal? automatically matching it
@@ -302,12 +496,52 @@ class Amplitude(Transform):
             else:
                 raise TypeError("Unsupported amplitude type")
 
+    def stream(self, source, extent, sample_rate):
+        amps = self.amps * extent[2] if len(self.amps) == 1 and extent[2] > 1 else self.amps
+        gains = []
+        
+        for amp in amps:
+            if isnumber(amp):
+                gains.append(amp)
+            elif isinstance(amp, Curve):
+                gains.append((amp.evaluate(sample_rate), amp.endpoint()))
+                _check_fits(self, min(amp.num_samples(sample_rate), extent[1] - extent[0]), len(gains[-1][0]))
+            else:
+                raise TypeError("Unsupported amplitude type")
+        
+        return _gain_block(source, extent, gains)
+
+def _gain_block(source, extent, gains):
+    """ streaming implementation shared by Gain and Amplitude.
+    gains holds for each channel either a number, or a tuple (vals, endpoint),
+    vals being the amplitudes for the beginning of the audio and endpoint the one for the rest.
+    """
+    def block(start, length):
+        audio = source(start, length)
+        offset = start - extent[0]
+        
+        for (i, gain) in enumerate(gains):
+            if not isinstance(gain, tuple):
+                audio[i,:] *= gain
+                continue
+            
+            vals, endpoint = gain
+            vals = vals[offset:offset+length]
+            audio[i,:len(vals)] *= vals
+            audio[i,len(vals):] *= endpoint
+        
+        return audio
+    
+    return block
+
 class SineAM(Transform):
     """
     have the amplitude change according to a sine function over time continuously,
     with given width (size) and frequency
     TODO again the factors should be perhaps logarithimic
     """
+    fusable = True
+    
     def __init__(self, frequency, size, phase=0):
         self.frequency = frequency
         self.size = size
@@ -322,6 +556,18 @@ class SineAM(Transform):
         audio *= (sin * self.size + (1-self.size))
         # remember [:] is necessary to retain changes
         
+    def stream(self, source, extent, sample_rate):
+        length_total = extent[1] - extent[0]
+        duration = length_total/sample_rate*sec # as in Audio.duration
+        
+        def block(start, length):
+            audio = source(start, length)
+            sin = np.sin(self.phase + self.frequency * \
+                         linspace_range(duration/sec, length_total, start - extent[0], length) * 2 * np.pi)
+            audio *= (sin * self.size + (1-self.size))
+            return audio
+        
+        return block
 
 
 class Limiter(Transform):
@@ -356,20 +602,23 @@ class Limiter(Transform):
     
     def realise(self, audio):
         # convert to the amplitude case then continue normally
+        # (without storing it, as the same Limiter may be realised concurrently)
         if self.is_max:
+            max_amplitude = self.max_amplitude
             if self.max_ratio is not None:
-                self.max_amplitude = self.max_ratio*np.max(np.abs(audio.audio))
+                max_amplitude = self.max_ratio*np.max(np.abs(audio.audio))
         
             # TODO do the same for dBs
-            np.clip(audio.audio, -self.max_amplitude, self.max_amplitude, out=audio.audio)
+            np.clip(audio.audio, -max_amplitude, max_amplitude, out=audio.audio)
         
         if self.is_min:
+            min_amplitude = self.min_amplitude
             if self.min_ratio is not None:
-                self.min_amplitude = self.min_ratio*np.max(np.abs(audio.audio))
+                min_amplitude = self.min_ratio*np.max(np.abs(audio.audio))
             #TODO same for dBs
             
             audio.audio[:,:] = np.sign(audio.audio) * \
-                               np.clip(np.abs(audio.audio), a_min=self.min_amplitude, a_max=None)
+                               np.clip(np.abs(audio.audio), a_min=min_amplitude, a_max=None)
         
 
 
@@ -378,9 +627,17 @@ class Limiter(Transform):
 class Mono(Transform):
     """ transforms multi-channel audio to mono
     """
+    in_place = False
+    
     def realise(self, audio):
         audio.audio = np.sum(audio.audio, axis=0, keepdims=True)
         # TODO should we normalize the sum?
+    
+    def extent(self, extent, sample_rate):
+        return (extent[0], extent[1], 1)
+    
+    def stream(self, source, extent, sample_rate):
+        return lambda start, length: np.sum(source(start, length), axis=0, keepdims=True)
 
 class Pan(Transform):
     """ applies arbitrary function to amplitudes of all channels
@@ -394,10 +651,11 @@ class Pan(Transform):
     
     # TODO faster computations
     # TODO put the default stereo scheme as well as the pan law as package variables
-    pan_shape = lambda x: np.log(x/Pan.width + 0.5)*(-Pan.panLaw / np.log(2)) # +0.1 to prevent log(0)
-    LdB = lambda x: Pan.pan_shape(-x)
-    RdB = lambda x: Pan.pan_shape(x)
-    defaultStereo = lambda x: (Pan.LdB(x), Pan.RdB(x))
+    # these are functions rather than lambdas, so Pan may be pickled (see gensound.parallel)
+    def pan_shape(x): return np.log(x/Pan.width + 0.5)*(-Pan.panLaw / np.log(2)) # +0.1 to prevent log(0)
+    def LdB(x): return Pan.pan_shape(-x)
+    def RdB(x): return Pan.pan_shape(x)
+    def defaultStereo(x): return (Pan.LdB(x), Pan.RdB(x))
     
     def __init__(self, pan, scheme=defaultStereo):
         """ pan is a number or curve, which will be fed into the
@@ -417,19 +675,39 @@ class Pan(Transform):
         # or maybe we can string some monos together and apply same panning for all?
         assert audio.num_channels == 1, "panning is from mono to multi"
         
+        gains = self._gains(audio.sample_rate)
+        audio.from_mono(len(gains))
+        
+        for (i, gain) in enumerate(gains):
+            if isnumber(gain):
+                audio.audio[i,:] *= gain
+            else: # paramterization
+                audio.audio[i,:len(gain)] *= gain
+                audio.audio[i,len(gain):] *= DB_to_Linear(self.scheme(self.pan.endpoint())[i])
+    
+    def _gains(self, sample_rate):
+        """ the amplitudes of each channel, either numbers or arrays """
+        to_gains = lambda pan: [DB_to_Linear(dB) for dB in self.scheme(pan)]
+        
         if isnumber(self.pan):
-            dBs = self.scheme(self.pan)
+            return to_gains(self.pan)
         elif isinstance(self.pan, Curve):
-            dBs = self.scheme(self.pan.flatten(audio.sample_rate))
+            return self.pan.evaluate(sample_rate, to_gains)
+    
+    def extent(self, extent, sample_rate):
+        pan = self.pan if isnumber(self.pan) else self.pan.endpoint()
+        return (extent[0], extent[1], len(self.scheme(pan)))
+    
+    def stream(self, source, extent, sample_rate):
+        if extent[2] != 1:
+            return None # let realise complain
         
-        audio.from_mono(len(dBs))
+        gains = [gain if isnumber(gain)
+                 else (gain, DB_to_Linear(self.scheme(self.pan.endpoint())[i]))
+                 for (i, gain) in enumerate(self._gains(sample_rate))]
         
-        for (i, dB) in enumerate(dBs):
-            if isnumber(dB):
-                audio.audio[i,:] *= DB_to_Linear(dB)
-            else: # paramterization
-                audio.audio[i,:len(dB)] *= DB_to_Linear(dB)
-                audio.audio[i,len(dB):] *= DB_to_Linear(self.scheme(self.pan.endpoint())[i])
+        expand = lambda start, length: np.repeat(source(start, length), len(gains), axis=0)
+        return _gain_block(expand, extent, gains)
 
 class Repan(Transform):
     """ Allows switching between channels.
@@ -450,6 +728,18 @@ class Repan(Transform):
             new_audio[i,:] = audio.audio[channel,:]
             
         audio.audio[:,:] = new_audio[:,:]
+    
+    def stream(self, source, extent, sample_rate):
+        def block(start, length):
+            audio = source(start, length)
+            new_audio = np.zeros(audio.shape, dtype=np.float64)
+            for i, channel in enumerate(self.channels):
+                if channel is None:
+                    continue
+                new_audio[i,:] = audio[channel,:]
+            return new_audio
+        
+        return block
 
 
 ###### EXPERIMENTS ######
@@ -514,23 +804,29 @@ class Convolution(Transform):
         
         from scipy.signal import convolve, oaconvolve
         
-        # TODO this is too wordy
         # TODO mode="same" possibly should be "full"
-        if self.response.shape[0] == 1: # apply same mono reverb to all channels
-            for i in range(audio.num_channels):
-                audio.audio[i,:] = convolve(audio.audio[i,:], self.response[0,:], mode="same")
-        elif audio.is_mono: # input signal gains new channels
+        if audio.is_mono: # input signal gains new channels
             audio.from_mono(self.response.shape[0])
-            for i in range(self.response.shape[0]):
-                audio.audio[i,:] = convolve(audio.audio[i,:], self.response[i,:], mode="same")
-        else: # both audio and response non-mono, same number of channels
-            for i in range(self.response.shape[0]): # "Parallel Stereo"
-                audio.audio[i,:] = convolve(audio.audio[i,:], self.response[i,:], mode="same")
+        # otherwise, mono response applies the same reverb to all channels,
+        # or both are non-mono with the same number of channels ("Parallel Stereo")
+        
+        def convolve_channel(i):
+            response = self.response[0 if self.response.shape[0] == 1 else i,:]
+            audio.audio[i,:] = convolve(audio.audio[i,:], response, mode="same")
+        
+        parallel.map_channels(convolve_channel, audio.num_channels)
+    
+    def extent(self, extent, sample_rate):
+        if extent[2] == 1: # signal gains the channels of the response
+            return (extent[0], extent[1], self.response.shape[0])
+        return extent
 
 
 class ADSR(Transform):
     """ applied ADSR envelope to signal
     """
+    fusable = True
+    
     # TODO what if attack+decay+release > signal.duration?
     def __init__(self, attack, decay, sustain, release, hold=0): #hold=None?
         self.attack = attack
@@ -550,6 +846,44 @@ class ADSR(Transform):
         audio.audio[:,:length_start] *= env_start.flatten(audio.sample_rate)
         audio.audio[:,length_start:-length_end] *= self.sustain
         audio.audio[:,-length_end:] *= env_end.flatten(audio.sample_rate)
+    
+    def stream(self, source, extent, sample_rate):
+        # same envelopes as in realise, applied in the same order
+        env_start = Line(0, 1, self.attack) | Constant(1, self.hold)
+        env_start |= Line(1, self.sustain, duration = self.decay)
+        env_start = env_start.flatten(sample_rate)
+        env_end = Line(self.sustain, 0, duration=self.release).flatten(sample_rate)
+        
+        length_total = extent[1] - extent[0]
+        end_start = length_total - len(env_end) # where the release begins
+        
+        _check_fits(self, min(len(env_start), length_total), len(env_start))
+        # note that audio[:,-0:] in realise() is all of it
+        applied = length_total if len(env_end) == 0 else min(len(env_end), length_total)
+        _check_fits(self, applied, len(env_end))
+        
+        def block(start, length):
+            audio = source(start, length)
+            offset = start - extent[0]
+            
+            # attack/hold/decay
+            end = min(offset + length, len(env_start))
+            if offset < end:
+                audio[:,:end-offset] *= env_start[offset:end]
+            
+            # sustain
+            begin, end = max(offset, len(env_start)), min(offset + length, end_start)
+            if begin < end:
+                audio[:,begin-offset:end-offset] *= self.sustain
+            
+            # release
+            begin = max(offset, end_start)
+            if begin < offset + length:
+                audio[:,begin-offset:] *= env_end[begin-end_start:offset+length-end_start]
+            
+            return audio
+        
+        return block
 
 
 
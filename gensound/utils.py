@@ -39,6 +39,15 @@ def samples_slice(slc, sample_rate): return slice(
                                                      else num_samples(slc.stop, sample_rate),
                                                 slc.step)
 
+def linspace_range(stop, num, start, length):
+    """ returns np.linspace(0, stop, num, endpoint=False)[start:start+length],
+    without computing the rest of it. The values are identical to those of linspace,
+    so signals rendered piece by piece (i.e. when streaming) match the full rendering.
+    """
+    if num == 0:
+        return np.zeros(0, dtype=np.float64)
+    return np.arange(start, start+length, dtype=np.float64) * (stop / num)
+
 
 ############### Interpolation
 
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Compares realise() times of the serial path with the process and thread schedulers
+(see gensound.parallel), for an increasing number of workers.
+Also checks that all of them produce identical audio.
+
+Run as a script: python benchmarkParallel.py [max_workers]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+from gensound.signals import Sine, Square, Sawtooth
+from gensound.transforms import Gain, Shift, Pan, Convolution
+from gensound.filters import SimpleLPF
+
+
+def many_branches(num_branches=32, duration=10e3):
+    """ many mid-size branches, each involving some filtering """
+    waves = (Sine, Square, Sawtooth)
+    return sum([waves[i % 3](frequency=110*(1 + i/8), duration=duration)*SimpleLPF(2000)*Gain(-12)
+                * Pan(100*((2*i + 1)/num_branches - 1))*Shift(float(i*50))
+                for i in range(num_branches)])
+
+def few_channels(duration=20e3):
+    """ a few heavy branches, followed by a multichannel convolution """
+    response = np.random.default_rng(0).random((4, 2**14)) * np.linspace(1, 0, 2**14)
+    return sum([Square(frequency=55*(i+1), duration=duration)*Convolution(response[i:i+1,:])
+                for i in range(4)])*Convolution(response)
+
+def measure(signal, sample_rate, **kwargs):
+    start = time.perf_counter()
+    audio = signal.realise(sample_rate, **kwargs)
+    return (time.perf_counter() - start, audio.audio)
+
+def benchmark(name, signal, sample_rate=44100, max_workers=os.cpu_count()):
+    print(f"\n{name}")
+    serial_time, reference = measure(signal, sample_rate)
+    print(f"{'serial':>8}: {serial_time:7.3f}s")
+    
+    workers = 2
+    while workers <= max(max_workers, 2):
+        for scheduler in ("process", "thread"):
+            duration, audio = measure(signal, sample_rate, workers=workers, scheduler=scheduler)
+            assert np.array_equal(audio, reference), f"{scheduler} scheduler output differs"
+            print(f"{scheduler:>8}: {duration:7.3f}s with {workers} workers (x{serial_time/duration:.2f})")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    benchmark("32 filtered branches", many_branches(), max_workers=max_workers)
+    benchmark("4 convolved branches", few_channels(), max_workers=max_workers)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the vectorized Curve.integral against the original implementation,
+which summed each prefix of the values separately.
+
+Run as a script: python testCurve.py
+"""
+
+import numpy as np
+
+from gensound.curve import Curve
+
+
+def reference_integral(curve, sample_rate):
+    """ the original (quadratic) implementation of Curve.integral """
+    vals = curve.flatten(sample_rate, inclusive=True)
+    return np.asarray([sum(vals[0:i+1])*i/((i+1)*sample_rate) for i in range(len(vals))], dtype=np.float64)
+
+def test_integral():
+    curves = [Curve(lambda t: 220 + 100*t, 50.0),
+              Curve(lambda t: 440*np.exp(-3*t), 100.0),
+              Curve(lambda t: 110 + 0*t, 1),
+              Curve(lambda t: 330 + 20*np.sin(2*np.pi*5*t), 301)]
+    
+    for curve in curves:
+        for sample_rate in (8000, 22050, 44100):
+            expected = reference_integral(curve, sample_rate)
+            result = curve.integral(sample_rate)
+            assert result.shape == expected.shape
+            assert np.array_equal(result, expected), np.abs(result - expected).max()
+
+
+if __name__ == "__main__":
+    test_integral()
+    print("OK")
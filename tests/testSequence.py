@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that sequences whose notes are rendered together (see Sequence._realise_children)
+are placed as concatenating them one by one would, also when the sequence
+already starts before 0, by comparing realise() against extent() and stream().
+
+Run as a script: python testSequence.py
+"""
+
+import numpy as np
+
+from gensound import Sine, Square
+from gensound.transforms import Shift
+
+
+def test_note_placement():
+    sequences = [Sine(220, 100.0)*Shift(-20.0) | Sine(330, 100.0) | Sine(440, 50.0),
+                 Sine(220, 100.0) | Square(110, 30.0)*Shift(-50.0) | Sine(330, 100.0) | Sine(440, 50.0),
+                 Sine("C4 D E F G", 50.0)]
+    
+    for sequence in sequences:
+        audio = sequence.realise(44100)
+        assert (audio.abs_start(), audio.abs_end(), audio.num_channels) == sequence.extent(44100)
+        
+        streamed = np.concatenate([block.audio for block in sequence.stream(44100, block_size=1000)], axis=1)
+        assert streamed.shape == audio.audio.shape
+        assert np.allclose(streamed, audio.audio)
+
+
+if __name__ == "__main__":
+    test_note_placement()
+    print("OK")